@@ -0,0 +1,181 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+# Expensive routes and their limits; other routes are never queued or shed.
+# Override with ADMISSION_LIMITS, a JSON object of the same shape.
+DEFAULT_LIMITS = {
+    "/api/generate-story": {"initial": 8, "min": 1, "max": 32, "target_latency": 20.0},
+    "/api/text-to-speech": {"initial": 8, "min": 1, "max": 32, "target_latency": 5.0},
+}
+# Requests beyond the limit wait briefly in a bounded queue before being shed
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', '16'))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_MS', '2000')) / 1000
+# Multiplicative decrease applied when upstream latency exceeds the target
+BACKOFF_FACTOR = 0.75
+EWMA_ALPHA = 0.2
+
+
+class AdaptiveLimiter:
+    """Concurrency limit for one route, adjusted by AIMD on observed latency.
+
+    Each fast, successful response that finishes while the limit is fully
+    used raises it by 1/limit (about one slot per round of requests), so
+    the limit only grows when it is what holds requests back; a slow or
+    failed response cuts it by
+    BACKOFF_FACTOR, at most once per target_latency so one burst of slow
+    responses counts as a single congestion signal.
+    """
+
+    def __init__(self, route: str, initial: int, min: int, max: int, target_latency: float):
+        self.route = route
+        self.limit = float(initial)
+        self.min_limit = min
+        self.max_limit = max
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.ewma_latency: Optional[float] = None
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self) -> bool:
+        if self._has_capacity() and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= ADMISSION_QUEUE_SIZE:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, ADMISSION_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            # Handed a slot just as the wait timed out: give it back
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            # Handed a slot just as the request was cancelled: give it back
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        # release() already counted this request as in flight
+        self.admitted += 1
+        return True
+
+    def release(self, latency: float, ok: bool):
+        saturated = self.in_flight >= int(self.limit) or bool(self._waiters)
+        self.in_flight -= 1
+        self.ewma_latency = latency if self.ewma_latency is None \
+            else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+
+        now = time.monotonic()
+        if not ok or latency > self.target_latency:
+            if now - self._last_decrease > self.target_latency:
+                self.limit = max(self.min_limit, self.limit * BACKOFF_FACTOR)
+                self._last_decrease = now
+        elif saturated:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        # Hand free slots to queued requests in arrival order
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up."""
+        latency = self.ewma_latency if self.ewma_latency is not None else self.target_latency
+        return max(1, math.ceil(latency / max(self.limit, 1)))
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "ewma_latency": self.ewma_latency,
+            "target_latency": self.target_latency,
+        }
+
+
+def limiters_from_env() -> Dict[str, AdaptiveLimiter]:
+    limits = DEFAULT_LIMITS
+    if os.environ.get('ADMISSION_LIMITS'):
+        limits = {**DEFAULT_LIMITS, **json.loads(os.environ['ADMISSION_LIMITS'])}
+    return {route: AdaptiveLimiter(route, **config) for route, config in limits.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying per-route admission control.
+
+    Over-limit requests are rejected with 503 and Retry-After before their
+    body is read. Latency is measured to the start of the response, which is
+    when the upstream model has answered, even for streamed audio; the slot
+    is held until the body has been fully sent.
+    """
+
+    def __init__(self, app, limiters: Dict[str, AdaptiveLimiter]):
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiters.get(scope["path"]) if scope["type"] == "http" else None
+        if limiter is None or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire():
+            await self._reject(limiter, send)
+            return
+
+        started = time.monotonic()
+        response = {"latency": None, "status": 500}
+
+        async def send_and_measure(message):
+            if message["type"] == "http.response.start":
+                response["latency"] = time.monotonic() - started
+                response["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            latency = response["latency"] if response["latency"] is not None else time.monotonic() - started
+            # Client errors say nothing about upstream health; 5xx and timeouts do
+            limiter.release(latency, ok=response["status"] < 500)
+
+    @staticmethod
+    async def _reject(limiter: AdaptiveLimiter, send):
+        body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(limiter.retry_after()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,98 @@
+"""Bring stored story content in line with the current compression settings.
+
+Usage (from the backend directory):
+    python migrate_story_content.py
+        # re-encode stories whose codec or dictionary differs from the current
+        # STORY_CONTENT_CODEC / STORY_CONTENT_DICT (plain text included)
+    python migrate_story_content.py --train-dict dictionaries/
+        # write <id>.dict trained on existing stories into the directory, then
+        # set STORY_CONTENT_DICT=dictionaries/<id>.dict before migrating / serving.
+        # Keep older .dict files in the same directory: stories compressed with
+        # them stay readable until they have been migrated.
+"""
+import argparse
+import asyncio
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+import story_codec  # noqa: E402
+
+
+async def train(db, directory: str, sample_size: int):
+    docs = await db.stories.find({}, {"content": 1, "content_codec": 1, "content_dict": 1}) \
+        .sort("created_at", -1).to_list(sample_size)
+    samples = [story_codec.decompress_content(doc) for doc in docs]
+    data = story_codec.train_dictionary(samples)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{story_codec.dictionary_id(data)}.dict")
+    with open(path, 'wb') as f:
+        f.write(data)
+    print(f"Wrote dictionary trained on {len(samples)} stories to {path}")
+
+
+def outdated_query() -> dict:
+    """Stories not stored with the current codec and dictionary."""
+    codec = story_codec.current_codec()
+    if codec == 'none':
+        return {"content_codec": {"$exists": True}}
+    _, current_id = story_codec.current_dictionary()
+    if current_id is None:
+        stale_dict = {"content_dict": {"$exists": True}}
+    else:
+        stale_dict = {"content_dict": {"$ne": current_id}}
+    return {"$or": [{"content_codec": {"$ne": codec}}, stale_dict]}
+
+
+def reencode(doc: dict) -> UpdateOne:
+    fields = story_codec.compress_content(story_codec.decompress_content(doc))
+    update = {"$set": fields}
+    # Drop codec fields the new encoding doesn't use, e.g. both of them when switching to "none"
+    unset = {field: "" for field in ("content_codec", "content_dict") if field not in fields}
+    if unset:
+        update["$unset"] = unset
+    return UpdateOne({"_id": doc["_id"]}, update)
+
+
+async def migrate(db, batch_size: int):
+    migrated = 0
+    cursor = db.stories.find(outdated_query(), {"id": 1, "content": 1, "content_codec": 1, "content_dict": 1})
+    batch = []
+    async for doc in cursor:
+        batch.append(reencode(doc))
+        if len(batch) >= batch_size:
+            await db.stories.bulk_write(batch, ordered=False)
+            migrated += len(batch)
+            batch = []
+    if batch:
+        await db.stories.bulk_write(batch, ordered=False)
+        migrated += len(batch)
+    print(f"Re-encoded content of {migrated} stories")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--train-dict', metavar='DIR', help="train a shared dictionary into DIR instead of migrating")
+    parser.add_argument('--samples', type=int, default=500, help="stories used to train the dictionary")
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if args.train_dict:
+            await train(db, args.train_dict, args.samples)
+        else:
+            await migrate(db, args.batch_size)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
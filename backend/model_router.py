@@ -0,0 +1,184 @@
+import json
+import logging
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+# Candidate backends per task, in order of preference. Backends that have not
+# answered yet are tried in this order, after any that have.
+# Override with MODEL_ROUTES, a JSON object of the same shape.
+DEFAULT_ROUTES = {
+    "detect": [
+        {"provider": "gemini", "model": "gemini-1.5-flash", "cost": 1.0},
+        {"provider": "gemini", "model": "gemini-1.5-flash-8b", "cost": 0.5},
+    ],
+    "story": [
+        {"provider": "gemini", "model": "gemini-1.5-flash", "cost": 1.0},
+        {"provider": "gemini", "model": "gemini-1.5-pro", "cost": 4.0},
+    ],
+    "image": [
+        {"provider": "gemini", "model": "gemini-1.5-flash", "cost": 1.0},
+    ],
+    "tts": [
+        {"provider": "openai", "model": "tts-1", "cost": 1.0},
+        {"provider": "openai", "model": "tts-1-hd", "cost": 2.0},
+    ],
+}
+
+# Provider each task's callers know how to talk to
+TASK_PROVIDERS = {"detect": "gemini", "story": "gemini", "image": "gemini", "tts": "openai"}
+
+EWMA_ALPHA = float(os.environ.get('ROUTER_EWMA_ALPHA', '0.2'))
+# Share of calls sent to a non-best backend so its latency estimate stays fresh (off by default)
+EXPLORE_RATE = float(os.environ.get('ROUTER_EXPLORE_RATE', '0'))
+# Client errors that point at the backend rather than the request: a model that
+# is unknown or not enabled for the key. A 400 only counts when it names the model.
+FALLBACK_STATUSES = {400, 403, 404, 429}
+
+
+def is_failure(response: httpx.Response) -> bool:
+    """Responses worth retrying on another backend: rejections, throttling and server errors."""
+    return response.status_code in FALLBACK_STATUSES or response.status_code >= 500
+
+
+async def rejects_request(response: httpx.Response, backend: "Backend") -> bool:
+    """A 400 about the request itself, e.g. TTS input over the length limit.
+
+    Every backend would reject it the same way, and it says nothing about
+    this backend's health, so it is neither retried nor recorded.
+    """
+    if response.status_code != 400:
+        return False
+    body = (await response.aread()).decode(errors="replace")
+    return backend.model not in body
+
+
+class Backend:
+    def __init__(self, task: str, provider: str, model: str, cost: float = 1.0):
+        self.task = task
+        self.provider = provider
+        self.model = model
+        self.cost = cost
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+    def score(self) -> float:
+        # Lower is better: slow, expensive or failing backends are pushed down.
+        # Unmeasured backends rank last, keeping their configured order (sorting is stable).
+        if self.ewma_latency is None:
+            return math.inf
+        return self.ewma_latency * self.cost / max(1.0 - self.error_rate, 0.05)
+
+    def record(self, latency: float, ok: bool):
+        self.calls += 1
+        if ok:
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+        else:
+            self.failures += 1
+        self.error_rate = EWMA_ALPHA * (0.0 if ok else 1.0) + (1 - EWMA_ALPHA) * self.error_rate
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "cost": self.cost,
+            "ewma_latency": self.ewma_latency,
+            "error_rate": round(self.error_rate, 4),
+            "calls": self.calls,
+            "failures": self.failures,
+            "score": round(self.score(), 4) if self.ewma_latency is not None else None,
+        }
+
+
+class ModelRouter:
+    """Picks a backend per task by live latency, error rate and cost, falling back on failure."""
+
+    def __init__(self, routes: Dict[str, List[dict]]):
+        for task, candidates in routes.items():
+            if task not in TASK_PROVIDERS:
+                raise ValueError(f"Unknown task in model routes: {task}")
+            if not candidates:
+                raise ValueError(f"No backends configured for task {task}")
+            for candidate in candidates:
+                if candidate.get("provider") != TASK_PROVIDERS[task]:
+                    raise ValueError(f"{task} calls only support provider {TASK_PROVIDERS[task]}, "
+                                     f"got {candidate.get('provider')}")
+        self.backends = {
+            task: [Backend(task, **candidate) for candidate in candidates]
+            for task, candidates in routes.items()
+        }
+        self.decisions = deque(maxlen=100)
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        routes = DEFAULT_ROUTES
+        if os.environ.get('MODEL_ROUTES'):
+            routes = {**DEFAULT_ROUTES, **json.loads(os.environ['MODEL_ROUTES'])}
+        return cls(routes)
+
+    def ranked(self, task: str) -> List[Backend]:
+        candidates = sorted(self.backends[task], key=lambda backend: backend.score())
+        if len(candidates) > 1 and random.random() < EXPLORE_RATE:
+            explored = candidates.pop(random.randrange(1, len(candidates)))
+            candidates.insert(0, explored)
+        return candidates
+
+    async def call(self, task: str, send: Callable[[Backend], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Call send() with the best backend for the task, trying the next one on failure.
+
+        If every backend fails, the last response is returned (or the last
+        error raised) so callers keep their existing error handling.
+        """
+        response = None
+        error = None
+        for attempt, backend in enumerate(self.ranked(task)):
+            if response is not None:
+                # Release the failed attempt before retrying elsewhere
+                await response.aclose()
+                response = None
+            started = time.monotonic()
+            try:
+                response = await send(backend)
+                error = None
+                if await rejects_request(response, backend):
+                    return response
+                ok = not is_failure(response)
+            except httpx.HTTPError as e:
+                error = e
+                ok = False
+            latency = time.monotonic() - started
+            backend.record(latency, ok)
+            self.decisions.append({
+                "task": task,
+                "backend": backend.name,
+                "attempt": attempt,
+                "latency": round(latency, 4),
+                "ok": ok,
+                "at": time.time(),
+            })
+            if ok:
+                return response
+            logging.warning(f"{task} call to {backend.name} failed, trying next backend")
+        if error is not None:
+            raise error
+        return response
+
+    def snapshot(self) -> dict:
+        return {
+            "tasks": {task: [backend.stats() for backend in sorted(backends, key=lambda b: b.score())]
+                      for task, backends in self.backends.items()},
+            "recent_decisions": list(self.decisions),
+        }
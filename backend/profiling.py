@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, deque
+from typing import Callable, Dict, Optional
+
+# Share of requests profiled automatically (0 disables); X-Profile: 1 forces it for admins
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', '20'))
+# Profiles stop recording after this long, so SSE and long-poll requests don't keep the sampler running
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '30'))
+# Log the event loop's stack when it is blocked longer than this (0 disables)
+LOOP_LAG_THRESHOLD_SECONDS = float(os.environ.get('LOOP_LAG_THRESHOLD_MS', '500')) / 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _folded_stack(frame) -> str:
+    """Render a frame as a collapsed stack line understood by flamegraph.pl and speedscope."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack while at least one profile is recording.
+
+    All requests share the event loop thread, so a profile also contains
+    samples from requests that ran concurrently with the profiled one.
+    """
+
+    def __init__(self):
+        self.profiles = deque(maxlen=PROFILE_BUFFER_SIZE)
+        self._active: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._target_thread_id: Optional[int] = None
+
+    def start(self, profile_id: str):
+        with self._lock:
+            self._target_thread_id = threading.get_ident()
+            self._active[profile_id] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, profile_id: str, route: str, started_at: float, duration: float, truncated: bool = False):
+        with self._lock:
+            samples = self._active.pop(profile_id, None)
+        if samples is None:
+            # Already stopped at PROFILE_MAX_SECONDS
+            return
+        self.profiles.append({
+            "id": profile_id,
+            "route": route,
+            "started_at": started_at,
+            "duration": round(duration, 4),
+            "truncated": truncated,
+            "samples": samples,
+        })
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                frame = sys._current_frames().get(self._target_thread_id)
+                if frame is not None:
+                    stack = _folded_stack(frame)
+                    for samples in self._active.values():
+                        samples[stack] += 1
+            time.sleep(PROFILE_INTERVAL_SECONDS)
+
+    def summaries(self):
+        return [
+            {**{key: value for key, value in profile.items() if key != "samples"},
+             "sample_count": sum(profile["samples"].values())}
+            for profile in self.profiles
+        ]
+
+    def folded(self, profile_id: str) -> Optional[str]:
+        for profile in self.profiles:
+            if profile["id"] == profile_id:
+                return "".join(f"{stack} {count}\n" for stack, count in profile["samples"].most_common())
+        return None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware recording a sampling profile for a share of requests.
+
+    Requests carrying X-Profile: 1 and a valid X-Admin-Token are always
+    profiled. The profile spans the whole response, including streamed bodies,
+    up to max_duration; longer responses keep only their first max_duration
+    seconds and are marked truncated.
+    """
+
+    def __init__(self, app, profiler: SamplingProfiler,
+                 get_admin_token: Callable[[], Optional[str]] = lambda: None,
+                 max_duration: float = PROFILE_MAX_SECONDS):
+        self.app = app
+        self.profiler = profiler
+        # Called per request: the token is only known once the app has started
+        self.get_admin_token = get_admin_token
+        self.max_duration = max_duration
+
+    def _should_profile(self, scope) -> bool:
+        headers = dict(scope.get("headers") or [])
+        admin_token = self.get_admin_token()
+        if headers.get(b"x-profile") == b"1" and admin_token \
+                and headers.get(b"x-admin-token") == admin_token.encode():
+            return True
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = str(uuid.uuid4())
+        started_at = time.time()
+        started = time.monotonic()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-profile-id", profile_id.encode()))
+            await send(message)
+
+        def finish(truncated: bool):
+            # FastAPI stores the matched route in the scope, so profiles group by template
+            route = getattr(scope.get("route"), "path", scope["path"])
+            self.profiler.stop(profile_id, f"{scope['method']} {route}", started_at,
+                               time.monotonic() - started, truncated)
+
+        self.profiler.start(profile_id)
+        cap = asyncio.get_running_loop().call_later(self.max_duration, finish, True)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            cap.cancel()
+            finish(False)
+
+
+class LoopLagMonitor:
+    """Watchdog that logs the event loop's stack when it stops responding.
+
+    A coroutine on the loop refreshes a heartbeat; a separate thread notices
+    when the heartbeat goes stale and dumps whatever the loop is running.
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD_SECONDS):
+        self.threshold = threshold
+        self.blocked_count = 0
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped: Optional[threading.Event] = None
+
+    async def _beat(self):
+        interval = self.threshold / 4
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            self.max_lag = max(self.max_lag, time.monotonic() - expected)
+            self._heartbeat = time.monotonic()
+
+    def _watch(self, stopped: threading.Event):
+        reported = False
+        while not stopped.wait(self.threshold / 2):
+            stalled_for = time.monotonic() - self._heartbeat
+            if stalled_for < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            self.blocked_count += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+            logger.warning(f"Event loop blocked for {stalled_for * 1000:.0f}ms, currently running:\n{stack}")
+
+    def start(self):
+        if self.threshold <= 0:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._beat())
+        # A fresh event per start, so a restarted monitor isn't born stopped
+        self._stopped = threading.Event()
+        threading.Thread(target=self._watch, args=(self._stopped,), name="loop-lag-monitor", daemon=True).start()
+
+    def stop(self):
+        if self._stopped:
+            self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "blocked_count": self.blocked_count,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+        }
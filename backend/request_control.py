@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import Counter
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+# Default end-to-end budget for a request, overridable per request with the header
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', '60'))
+MAX_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_MAX_SECONDS', '120'))
+DEADLINE_HEADER = 'X-Request-Timeout'
+DISCONNECT_POLL_SECONDS = 0.5
+
+# Work abandoned because the client went away or the deadline passed
+cancellation_stats = Counter()
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_request(cls, request: Request) -> "Deadline":
+        seconds = DEFAULT_DEADLINE_SECONDS
+        header = request.headers.get(DEADLINE_HEADER)
+        if header:
+            try:
+                seconds = float(header)
+            except ValueError:
+                seconds = math.nan
+            # nan would disable the deadline and <= 0 would fail before doing any work
+            if not math.isfinite(seconds) or seconds <= 0:
+                raise HTTPException(status_code=400, detail=f"Invalid {DEADLINE_HEADER} header: {header}")
+            seconds = min(seconds, MAX_DEADLINE_SECONDS)
+        return cls(seconds)
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Time left for an upstream call, raising 504 if nothing is left."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+        return min(remaining, cap) if cap else remaining
+
+
+async def _wait_for_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+async def run_until_disconnect(request: Request, coro, deadline: Deadline, name: str):
+    """Run a handler coroutine, cancelling it on client disconnect or deadline.
+
+    Cancelling the task cancels whichever upstream call it is awaiting, so no
+    further model calls or database writes happen for an abandoned request.
+    """
+    work = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({work, watcher}, timeout=deadline.remaining(),
+                                     return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+
+    if work in done:
+        error = work.exception()
+        if isinstance(error, HTTPException) and error.status_code == 504:
+            cancellation_stats[f"{name}.deadline_exceeded"] += 1
+        return work.result()
+
+    work.cancel()
+    if watcher in done:
+        cancellation_stats[f"{name}.client_disconnected"] += 1
+        logging.info(f"Client disconnected, cancelled {name}")
+        # Nobody is listening; the status code only shows up in access logs
+        raise HTTPException(status_code=499, detail="Client closed request")
+    cancellation_stats[f"{name}.deadline_exceeded"] += 1
+    raise HTTPException(status_code=504, detail="Request deadline exceeded")
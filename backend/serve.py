@@ -0,0 +1,46 @@
+"""Production entry point for the backend.
+
+Usage (from the backend directory):
+    python serve.py --workers 4 --port 8001
+
+The .env file is loaded here, before any worker starts, so every worker
+inherits the same environment. Each worker then creates its own MongoDB
+and HTTP clients in the app's lifespan, after the fork. On SIGTERM or
+SIGINT workers stop accepting connections and let in-flight requests
+finish for up to --graceful-timeout seconds before shutting down.
+"""
+import argparse
+import os
+from pathlib import Path
+
+import uvicorn
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+
+
+def main():
+    load_dotenv(ROOT_DIR / '.env')
+
+    parser = argparse.ArgumentParser(description="Run the bedtime story API")
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8001')))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', '1')))
+    parser.add_argument('--graceful-timeout', type=int,
+                        default=int(os.environ.get('GRACEFUL_TIMEOUT_SECONDS', '30')),
+                        help="seconds to let in-flight requests finish on shutdown")
+    args = parser.parse_args()
+
+    uvicorn.run(
+        "server:app",
+        app_dir=str(ROOT_DIR),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,149 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Body
-from dotenv import load_dotenv
+import time
+IMPORT_STARTED = time.monotonic()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Body, Request
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
 import logging
-from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
 from datetime import datetime
-import json
-import base64
-import requests
-from fastapi.responses import StreamingResponse
-import io
+import httpx
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+
+from story_codec import story_to_document, story_from_document, stories_from_documents, decompress_content
+from request_control import Deadline, run_until_disconnect, cancellation_stats
+from story_sync import StoryChangeNotifier, SyncCursor, encode_sync_token, decode_sync_token, changes_query, server_stamped
+from model_router import ModelRouter, Backend
+from profiling import SamplingProfiler, ProfilingMiddleware, LoopLagMonitor
+from write_buffer import WriteBehindBuffer
+from admission import AdmissionMiddleware, limiters_from_env
+from settings import Settings
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+# Configuration comes from the environment; serve.py (or uvicorn --env-file) loads .env.
+# Settings, model routes and admission limits are read, and shared resources created,
+# per worker in lifespan() below. Helper modules read their tuning knobs on import.
+# With several workers each one has its own routing state, limits, metrics and profiles.
+settings: Optional[Settings] = None
 
 # MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+OPENAI_SPEECH_URL = "https://api.openai.com/v1/audio/speech"
+
+# Story lists only inflate the start of each story (enough for its title);
+# the full text comes from /api/story/{id}, or from list routes with full=true
+STORY_PREVIEW_CHARS = 200
+
+# Story list sync: page size and how often waiting clients re-check MongoDB
+STORY_SYNC_LIMIT = 20
+STORY_SYNC_MAX_WAIT_SECONDS = 30
+STORY_SYNC_POLL_SECONDS = 5
+story_changes = StoryChangeNotifier()
+
+# Story inserts and audio_url updates are group-committed in bulk_write batches
+write_buffer = WriteBehindBuffer()
+
+# Status checks are read a page at a time
+STATUS_CHECK_PAGE_LIMIT = 1000
+readiness = {"ready": False, "checked_at": 0.0}
+readiness_lock: Optional[asyncio.Lock] = None
+
+profiler = SamplingProfiler()
+loop_lag_monitor = LoopLagMonitor()
+
+# Concurrency limits for expensive routes, filled in lifespan(); reads like /api/stories are never queued
+admission_limiters = {}
+
+# Picks the model for each upstream task (detect, story, image, tts)
+model_router: Optional[ModelRouter] = None
+
+# Shared HTTP client for upstream APIs; async so in-flight calls can be cancelled
+http_client: Optional[httpx.AsyncClient] = None
+
+# Import-to-ready timings for this worker
+startup_timings = {}
+
+def notify_written(collection: str):
+    if collection == "stories":
+        story_changes.notify()
+
+async def bootstrap_database():
+    """One-off MongoDB setup, run in the background so workers start serving immediately.
+
+    Each step runs on its own, so one failing doesn't skip the others.
+    """
+    steps = [
+        ("story sync index", ensure_story_sync_index),
+        ("status check TTL", ensure_status_check_ttl),
+        ("story change stream", lambda: story_changes.start(client, db.stories)),
+    ]
+    for name, step in steps:
+        try:
+            await step()
+        except Exception as e:
+            logger.error(f"Database bootstrap step '{name}' failed: {str(e)}")
+
+async def ensure_story_sync_index():
+    # Stories written before sync existed count as last updated when created
+    await db.stories.update_many({"updated_at": {"$exists": False}}, [{"$set": {"updated_at": "$created_at"}}])
+    await db.stories.create_index([("updated_at", 1), ("id", 1)])
+
+async def ensure_status_check_ttl():
+    # Expire old status checks so probes and dashboards don't grow the collection forever
+    indexes = await db.status_checks.index_information()
+    existing = indexes.get("timestamp_1")
+    if existing is None:
+        await db.status_checks.create_index("timestamp", expireAfterSeconds=settings.status_check_ttl_seconds)
+    elif existing.get("expireAfterSeconds") != settings.status_check_ttl_seconds:
+        # create_index would fail with IndexOptionsConflict; collMod changes the TTL in place
+        await db.command("collMod", "status_checks",
+                         index={"keyPattern": {"timestamp": 1}, "expireAfterSeconds": settings.status_check_ttl_seconds})
+        logger.info(f"Changed status_checks TTL to {settings.status_check_ttl_seconds}s")
 
-# API keys
-openai_api_key = os.environ.get('OPENAI_API_KEY')
-gemini_api_key = os.environ.get('GEMINI_API_KEY')
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global settings, model_router, client, db, http_client, readiness_lock
+    started = time.monotonic()
+    settings = Settings.from_env()
+    model_router = ModelRouter.from_env()
+    admission_limiters.update(limiters_from_env())
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = client[settings.db_name]
+    http_client = httpx.AsyncClient()
+    readiness_lock = asyncio.Lock()
+    write_buffer.start(db, on_flush=notify_written)
+    bootstrap = asyncio.create_task(bootstrap_database())
+    loop_lag_monitor.start()
+
+    ready = time.monotonic()
+    startup_timings.update(
+        import_ms=round((IMPORT_FINISHED - IMPORT_STARTED) * 1000, 1),
+        startup_ms=round((ready - started) * 1000, 1),
+        import_to_ready_ms=round((ready - IMPORT_STARTED) * 1000, 1)
+    )
+    logger.info(f"Worker {os.getpid()} ready in {startup_timings['import_to_ready_ms']}ms "
+                f"(import {startup_timings['import_ms']}ms, startup {startup_timings['startup_ms']}ms)")
+    try:
+        yield
+    finally:
+        bootstrap.cancel()
+        loop_lag_monitor.stop()
+        await story_changes.stop()
+        # Drain buffered writes before the Mongo client goes away
+        await write_buffer.stop()
+        await http_client.aclose()
+        client.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -42,12 +157,18 @@ class Story(BaseModel):
     image_url: Optional[str] = None
     audio_url: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class StoryRequest(BaseModel):
     prompt: str
     duration: int  # in minutes
     age: Optional[int] = 5  # default age if not provided
 
+class StoryChanges(BaseModel):
+    stories: List[Story]
+    next_token: Optional[str] = None
+    has_more: bool = False
+
 class StatusCheck(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     client_name: str
@@ -56,311 +177,441 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+# Upstream helpers
+async def call_gemini(task: str, text: str, generation_config: dict, deadline: Deadline) -> httpx.Response:
+    """POST a single-prompt generateContent request to the model routed for the task."""
+    return await model_router.call(task, lambda backend: _post_gemini(backend, text, generation_config, deadline))
+
+async def _post_gemini(backend: Backend, text: str, generation_config: dict, deadline: Deadline) -> httpx.Response:
+    return await http_client.post(
+        GEMINI_URL.format(model=backend.model),
+        headers={
+            "Content-Type": "application/json"
+        },
+        params={
+            "key": settings.gemini_api_key
+        },
+        json={
+            "contents": [
+                {
+                    "parts": [
+                        {
+                            "text": text
+                        }
+                    ]
+                }
+            ],
+            "generationConfig": generation_config
+        },
+        timeout=deadline.timeout()
+    )
+
+def placeholder_image_url(prompt: str) -> str:
+    return f"https://source.unsplash.com/random/1024x1024/?children,story,{prompt.replace(' ', ',')}"
+
 # API Routes
 @api_router.get("/")
 async def root():
     return {"message": "Hello World"}
 
+@api_router.get("/metrics")
+async def get_metrics():
+    return {
+        "worker": os.getpid(),
+        "cancellations": dict(cancellation_stats),
+        "event_loop": loop_lag_monitor.stats(),
+        "startup": startup_timings,
+        "write_buffer": write_buffer.stats(),
+        "admission": {route: limiter.stats() for route, limiter in admission_limiters.items()}
+    }
+
+def require_admin(request: Request):
+    if not settings.admin_token or request.headers.get("X-Admin-Token") != settings.admin_token:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@api_router.get("/admin/profiles")
+async def list_profiles(request: Request):
+    require_admin(request)
+    # Profiles are kept in memory by the worker that served the request
+    return [{**summary, "worker": os.getpid()} for summary in profiler.summaries()]
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, request: Request):
+    """Collapsed stacks, loadable by flamegraph.pl or speedscope."""
+    require_admin(request)
+    folded = profiler.folded(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found on worker {os.getpid()}")
+    return PlainTextResponse(
+        folded,
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'}
+    )
+
+@api_router.get("/routing")
+async def get_routing():
+    """Live routing state: per-backend latency, error rate and score, plus recent decisions."""
+    return {"worker": os.getpid(), **model_router.snapshot()}
+
 @api_router.post("/generate-story", response_model=Story)
-async def generate_story(request: StoryRequest):
+async def generate_story(request: StoryRequest, http_request: Request):
+    deadline = Deadline.from_request(http_request)
     try:
-        # Determine story length based on duration
-        if request.duration <= 5:
-            max_tokens = 800
-            complexity = "simple"
-        elif request.duration <= 10:
-            max_tokens = 1500
-            complexity = "moderate"
-        else:
-            max_tokens = 2500
-            complexity = "complex"
-            
-        # First detect the language of the prompt using Gemini
-        language_detection = requests.post(
-            "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent",
-            headers={
-                "Content-Type": "application/json"
-            },
-            params={
-                "key": gemini_api_key
-            },
-            json={
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "text": "Identify the language of the following text. Respond with ONLY the language name in English. For example: 'English', 'Spanish', 'French', etc.\n\nText: " + request.prompt
-                            }
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.2,
-                    "maxOutputTokens": 50
-                }
-            }
-        )
-        
-        if language_detection.status_code != 200:
-            language = "English"  # Default to English if detection fails
-        else:
-            try:
-                language = language_detection.json()["candidates"][0]["content"]["parts"][0]["text"].strip()
-            except (KeyError, IndexError):
-                language = "English"  # Default to English if parsing fails
-            
-        # Create age-appropriate instruction
-        age_guidance = ""
-        if request.age == 0:
-            age_guidance = "infants under 1 year old. Use extremely simple words, very short sentences, and lots of repetition. Focus on colors, shapes, sounds, and familiar objects. Keep it very short with rhythmic patterns."
-        elif request.age <= 3:
-            age_guidance = "very young children (1-3 years old). Use simple words, short sentences, and repetitive elements. Focus on basic concepts and familiar objects."
-        elif request.age <= 6:
-            age_guidance = "preschool children (4-6 years old). Use simple language with some new vocabulary. Include simple moral lessons and gentle adventure."
-        elif request.age <= 9:
-            age_guidance = "elementary school children (7-9 years old). Use moderate vocabulary with some challenge words. Include more complex storylines with clear moral lessons."
-        else:
-            age_guidance = "older children (10-12 years old). Use rich vocabulary and more complex sentence structures. Include more sophisticated themes while maintaining age-appropriate content."
-
-        # Generate story content using Gemini API (direct HTTP request)
-        prompt = f"""You are a children's bedtime story creator. Create a {request.duration} minute {complexity} bedtime story appropriate for {age_guidance} Make it engaging, descriptive, and with a positive message. Include a title at the beginning. The story should be written in {language}.
+        return await run_until_disconnect(http_request, _generate_story(request, deadline), deadline, "generate_story")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error generating story: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error generating story: {str(e)}")
 
-Create a bedtime story about: {request.prompt}"""
-        
-        story_response = requests.post(
-            "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent",
-            headers={
-                "Content-Type": "application/json"
-            },
-            params={
-                "key": gemini_api_key
-            },
-            json={
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "maxOutputTokens": max_tokens
-                }
-            }
-        )
-        
-        if story_response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Error from Gemini API: {story_response.text}")
+async def _generate_story(request: StoryRequest, deadline: Deadline) -> Story:
+    # Determine story length based on duration
+    if request.duration <= 5:
+        max_tokens = 800
+        complexity = "simple"
+    elif request.duration <= 10:
+        max_tokens = 1500
+        complexity = "moderate"
+    else:
+        max_tokens = 2500
+        complexity = "complex"
         
+    # First detect the language of the prompt using Gemini
+    language_detection = await call_gemini(
+        "detect",
+        "Identify the language of the following text. Respond with ONLY the language name in English. For example: 'English', 'Spanish', 'French', etc.\n\nText: " + request.prompt,
+        {
+            "temperature": 0.2,
+            "maxOutputTokens": 50
+        },
+        deadline
+    )
+    
+    if language_detection.status_code != 200:
+        language = "English"  # Default to English if detection fails
+    else:
         try:
-            story_content = story_response.json()["candidates"][0]["content"]["parts"][0]["text"].strip()
+            language = language_detection.json()["candidates"][0]["content"]["parts"][0]["text"].strip()
         except (KeyError, IndexError):
-            raise HTTPException(status_code=500, detail="Failed to parse story content from Gemini API")
-        
-        # Generate an image for the story using Gemini's Imagen model
-        image_prompt = f"A children's book illustration for a story about {request.prompt}, suitable for a {request.age} year old child. Cute, colorful, child-friendly style with subtle 3D effect."
-        
-        image_response = requests.post(
-            "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent",
-            headers={
-                "Content-Type": "application/json"
-            },
-            params={
-                "key": gemini_api_key
-            },
-            json={
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "text": f"Generate a high-quality image: {image_prompt}"
-                            }
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.4
-                }
-            }
-        )
+            language = "English"  # Default to English if parsing fails
         
-        if image_response.status_code != 200:
-            # If Gemini image generation fails, use a placeholder image
-            logging.error(f"Error from Gemini Image API: {image_response.text}")
-            image_url = f"https://source.unsplash.com/random/1024x1024/?children,story,{request.prompt.replace(' ', ',')}"
-        else:
-            try:
-                # Try to extract the image URL from Gemini's response
-                response_data = image_response.json()
-                
-                # Extract the image URL if it's in the expected format
-                if "candidates" in response_data and len(response_data["candidates"]) > 0:
-                    candidate = response_data["candidates"][0]
-                    if "content" in candidate and "parts" in candidate["content"]:
-                        for part in candidate["content"]["parts"]:
-                            if "inlineData" in part and "data" in part["inlineData"]:
-                                # Handle base64 image data if provided
-                                image_base64 = part["inlineData"]["data"]
-                                # Here we'd normally save this to a file or cloud storage
-                                # For simplicity, we'll use a placeholder URL
-                                image_url = f"https://source.unsplash.com/random/1024x1024/?children,story,{request.prompt.replace(' ', ',')}"
+    # Create age-appropriate instruction
+    age_guidance = ""
+    if request.age == 0:
+        age_guidance = "infants under 1 year old. Use extremely simple words, very short sentences, and lots of repetition. Focus on colors, shapes, sounds, and familiar objects. Keep it very short with rhythmic patterns."
+    elif request.age <= 3:
+        age_guidance = "very young children (1-3 years old). Use simple words, short sentences, and repetitive elements. Focus on basic concepts and familiar objects."
+    elif request.age <= 6:
+        age_guidance = "preschool children (4-6 years old). Use simple language with some new vocabulary. Include simple moral lessons and gentle adventure."
+    elif request.age <= 9:
+        age_guidance = "elementary school children (7-9 years old). Use moderate vocabulary with some challenge words. Include more complex storylines with clear moral lessons."
+    else:
+        age_guidance = "older children (10-12 years old). Use rich vocabulary and more complex sentence structures. Include more sophisticated themes while maintaining age-appropriate content."
+
+    # Generate story content using Gemini API (direct HTTP request)
+    prompt = f"""You are a children's bedtime story creator. Create a {request.duration} minute {complexity} bedtime story appropriate for {age_guidance} Make it engaging, descriptive, and with a positive message. Include a title at the beginning. The story should be written in {language}.
+
+Create a bedtime story about: {request.prompt}"""
+    
+    story_response = await call_gemini(
+        "story",
+        prompt,
+        {
+            "temperature": 0.7,
+            "maxOutputTokens": max_tokens
+        },
+        deadline
+    )
+    
+    if story_response.status_code != 200:
+        raise HTTPException(status_code=500, detail=f"Error from Gemini API: {story_response.text}")
+    
+    try:
+        story_content = story_response.json()["candidates"][0]["content"]["parts"][0]["text"].strip()
+    except (KeyError, IndexError):
+        raise HTTPException(status_code=500, detail="Failed to parse story content from Gemini API")
+    
+    # Generate an image for the story using Gemini's Imagen model
+    image_prompt = f"A children's book illustration for a story about {request.prompt}, suitable for a {request.age} year old child. Cute, colorful, child-friendly style with subtle 3D effect."
+    
+    image_response = await call_gemini(
+        "image",
+        f"Generate a high-quality image: {image_prompt}",
+        {
+            "temperature": 0.4
+        },
+        deadline
+    )
+    
+    image_url = None
+    if image_response.status_code != 200:
+        # If Gemini image generation fails, use a placeholder image
+        logging.error(f"Error from Gemini Image API: {image_response.text}")
+    else:
+        try:
+            # Try to extract the image URL from Gemini's response
+            response_data = image_response.json()
+            
+            # Extract the image URL if it's in the expected format
+            if "candidates" in response_data and len(response_data["candidates"]) > 0:
+                candidate = response_data["candidates"][0]
+                if "content" in candidate and "parts" in candidate["content"]:
+                    for part in candidate["content"]["parts"]:
+                        if "inlineData" in part and "data" in part["inlineData"]:
+                            # Base64 image data would normally be saved to file or cloud storage
+                            # For simplicity, we'll use a placeholder URL
+                            break
+                        if "text" in part and "http" in part["text"]:
+                            # Try to extract URL from text response
+                            urls = re.findall(r'https?://\S+', part["text"])
+                            if urls:
+                                image_url = urls[0].strip('.,;()"\'')
                                 break
-                            if "text" in part and "http" in part["text"]:
-                                # Try to extract URL from text response
-                                import re
-                                urls = re.findall(r'https?://\S+', part["text"])
-                                if urls:
-                                    image_url = urls[0].strip('.,;()"\'')
-                                    break
-                
-                # If we couldn't extract an image, use a placeholder
-                if 'image_url' not in locals():
-                    image_url = f"https://source.unsplash.com/random/1024x1024/?children,story,{request.prompt.replace(' ', ',')}"
-            except Exception as e:
-                logging.error(f"Error parsing Gemini image response: {str(e)}")
-                image_url = f"https://source.unsplash.com/random/1024x1024/?children,story,{request.prompt.replace(' ', ',')}"
-        
-        # Create a story object
-        story = Story(
-            prompt=request.prompt,
-            duration=request.duration,
-            content=story_content,
-            image_url=image_url
-        )
-        
-        # Save to database
-        await db.stories.insert_one(story.dict())
-        
-        return story
+        except Exception as e:
+            logging.error(f"Error parsing Gemini image response: {str(e)}")
     
-    except Exception as e:
-        logging.error(f"Error generating story: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error generating story: {str(e)}")
+    # If we couldn't extract an image, use a placeholder
+    if not image_url:
+        image_url = placeholder_image_url(request.prompt)
+    
+    # Create a story object
+    story = Story(
+        prompt=request.prompt,
+        duration=request.duration,
+        content=story_content,
+        image_url=image_url
+    )
+    
+    # Save to database (content is compressed at rest); wait until the batch is committed.
+    # Written as an upsert so MongoDB stamps updated_at for story-list sync.
+    await write_buffer.update(
+        "stories",
+        {"id": story.id},
+        server_stamped(story_to_document(story.dict())),
+        wait=True,
+        upsert=True
+    )
+    
+    return story
 
 @api_router.post("/text-to-speech")
-async def text_to_speech(story_id: dict = Body(...)):
+async def text_to_speech(http_request: Request, story_id: dict = Body(...)):
+    deadline = Deadline.from_request(http_request)
     try:
         # Extract story_id from the request body
         if not isinstance(story_id, dict) or "story_id" not in story_id:
             raise HTTPException(status_code=422, detail="Request body must contain 'story_id' field")
         
         story_id_str = story_id.get("story_id")
-        
-        # Get the story from the database
-        story_doc = await db.stories.find_one({"id": story_id_str})
-        if not story_doc:
-            raise HTTPException(status_code=404, detail="Story not found")
-        
-        story = Story(**story_doc)
-        
-        # Detect language of the story using Gemini
-        language_detection = requests.post(
-            "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent",
-            headers={
-                "Content-Type": "application/json"
-            },
-            params={
-                "key": gemini_api_key
-            },
-            json={
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "text": "Identify the language of the following text. Respond with ONLY the language name in English. For example: 'English', 'Spanish', 'French', etc.\n\nText: " + story.content[:200]  # First 200 chars should be enough
-                            }
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.2,
-                    "maxOutputTokens": 50
-                }
-            }
+        speech_response = await run_until_disconnect(
+            http_request, _start_speech(story_id_str, deadline), deadline, "text_to_speech"
         )
         
-        # Select appropriate voice based on language
-        if language_detection.status_code != 200:
-            voice = "nova"  # Default to Nova if detection fails
-        else:
+        # Stream audio until OpenAI is done or the listener goes away
+        async def iterfile():
+            completed = False
             try:
-                language = language_detection.json()["candidates"][0]["content"]["parts"][0]["text"].strip().lower()
-            except (KeyError, IndexError):
-                language = "english"  # Default to English if parsing fails
-            
-            # Map languages to appropriate voices
-            # OpenAI TTS voices: alloy, echo, fable, onyx, nova, shimmer
-            voice_map = {
-                "english": "nova",
-                "spanish": "alloy",
-                "french": "alloy",
-                "german": "alloy",
-                "italian": "alloy",
-                "portuguese": "alloy",
-                "japanese": "alloy",
-                "chinese": "alloy",
-                "arabic": "alloy",
-                "hindi": "alloy",
-                "russian": "alloy"
-            }
-            
-            voice = voice_map.get(language, "alloy")  # Default to alloy for other languages
+                async for chunk in speech_response.aiter_bytes(chunk_size=8192):
+                    yield chunk
+                completed = True
+            finally:
+                if not completed:
+                    cancellation_stats["text_to_speech.stream_cancelled"] += 1
+                await speech_response.aclose()
+        
+        return StreamingResponse(iterfile(), media_type="audio/mpeg")
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error generating speech: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
+
+async def _start_speech(story_id_str: str, deadline: Deadline) -> httpx.Response:
+    """Look up the story and open a streaming TTS response for it."""
+    # Get the story from the database
+    story_doc = await db.stories.find_one({"id": story_id_str})
+    if not story_doc:
+        raise HTTPException(status_code=404, detail="Story not found")
+    
+    # Only the opening of the story is needed for language detection
+    story_opening = decompress_content(story_doc, max_chars=200)
+    
+    # Detect language of the story using Gemini
+    language_detection = await call_gemini(
+        "detect",
+        "Identify the language of the following text. Respond with ONLY the language name in English. For example: 'English', 'Spanish', 'French', etc.\n\nText: " + story_opening,  # First 200 chars should be enough
+        {
+            "temperature": 0.2,
+            "maxOutputTokens": 50
+        },
+        deadline
+    )
+    
+    # Select appropriate voice based on language
+    if language_detection.status_code != 200:
+        voice = "nova"  # Default to Nova if detection fails
+    else:
+        try:
+            language = language_detection.json()["candidates"][0]["content"]["parts"][0]["text"].strip().lower()
+        except (KeyError, IndexError):
+            language = "english"  # Default to English if parsing fails
+        
+        # Map languages to appropriate voices
+        # OpenAI TTS voices: alloy, echo, fable, onyx, nova, shimmer
+        voice_map = {
+            "english": "nova",
+            "spanish": "alloy",
+            "french": "alloy",
+            "german": "alloy",
+            "italian": "alloy",
+            "portuguese": "alloy",
+            "japanese": "alloy",
+            "chinese": "alloy",
+            "arabic": "alloy",
+            "hindi": "alloy",
+            "russian": "alloy"
+        }
         
-        # Generate speech using OpenAI API (direct HTTP request)
-        speech_response = requests.post(
-            "https://api.openai.com/v1/audio/speech",
+        voice = voice_map.get(language, "alloy")  # Default to alloy for other languages
+    
+    story = Story(**story_from_document(story_doc))
+    
+    # Generate speech using OpenAI API (direct HTTP request)
+    async def send_speech(backend: Backend) -> httpx.Response:
+        speech_request = http_client.build_request(
+            "POST",
+            OPENAI_SPEECH_URL,
             headers={
-                "Authorization": f"Bearer {openai_api_key}",
+                "Authorization": f"Bearer {settings.openai_api_key}",
                 "Content-Type": "application/json"
             },
             json={
-                "model": "tts-1",
+                "model": backend.model,
                 "voice": voice,
                 "input": story.content
             },
-            stream=True
-        )
-        
-        if speech_response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Error from OpenAI TTS API: {speech_response.text}")
-        
-        # Convert to streaming response
-        def iterfile():
-            for chunk in speech_response.iter_content(chunk_size=8192):
-                yield chunk
-        
-        # Save audio URL to the database (would typically save to cloud storage in production)
-        story.audio_url = f"/api/audio/{story_id_str}"
-        await db.stories.update_one(
-            {"id": story_id_str},
-            {"$set": {"audio_url": story.audio_url}}
+            timeout=deadline.timeout()
         )
-        
-        return StreamingResponse(iterfile(), media_type="audio/mpeg")
+        return await http_client.send(speech_request, stream=True)
     
-    except Exception as e:
-        logging.error(f"Error generating speech: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
+    speech_response = await model_router.call("tts", send_speech)
+    
+    if speech_response.status_code != 200:
+        error_text = (await speech_response.aread()).decode(errors="replace")
+        await speech_response.aclose()
+        raise HTTPException(status_code=500, detail=f"Error from OpenAI TTS API: {error_text}")
+    
+    # Save audio URL to the database (would typically save to cloud storage in production).
+    # Not awaited: streaming starts right away and the update lands with the next batch.
+    # Replaying a story leaves it untouched, so clients are not sent it again.
+    story.audio_url = f"/api/audio/{story_id_str}"
+    await write_buffer.update(
+        "stories",
+        {"id": story_id_str, "audio_url": {"$ne": story.audio_url}},
+        server_stamped({"audio_url": story.audio_url}),
+        wait=False
+    )
+    
+    return speech_response
+
+def preview_chars(full: bool) -> Optional[int]:
+    return None if full else STORY_PREVIEW_CHARS
 
 @api_router.get("/stories", response_model=List[Story])
-async def get_stories():
+async def get_stories(full: bool = False):
     try:
         stories = await db.stories.find().sort("created_at", -1).to_list(20)
-        return [Story(**story) for story in stories]
+        return [Story(**story) for story in stories_from_documents(stories, preview_chars(full))]
     except Exception as e:
         logging.error(f"Error retrieving stories: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving stories: {str(e)}")
 
+async def current_sync_cursor() -> SyncCursor:
+    """A cursor that has seen every story version up to the newest change."""
+    fields = {"_id": 0, "id": 1, "updated_at": 1}
+    latest = await db.stories.find({}, fields).sort("updated_at", -1).limit(1).to_list(1)
+    if not latest:
+        return SyncCursor()
+    # Mark the whole lookback window as seen, or the next sync would resend it
+    recent = await db.stories.find(changes_query(SyncCursor(latest[0]["updated_at"])), fields).to_list(None)
+    return SyncCursor().advance(recent)
+
+async def fetch_story_changes(since: Optional[str], full: bool = False, limit: int = STORY_SYNC_LIMIT) -> StoryChanges:
+    if not since:
+        # First sync: the same newest-created stories as /stories, plus a token covering every
+        # change so far. The token is read first, so a write racing the snapshot is sent again
+        # on the next sync rather than skipped.
+        next_token = encode_sync_token(await current_sync_cursor())
+        docs = await db.stories.find().sort("created_at", -1).limit(limit).to_list(limit)
+        return StoryChanges(stories=[Story(**story) for story in stories_from_documents(docs, preview_chars(full))],
+                            next_token=next_token)
+
+    cursor = decode_sync_token(since)
+    docs = await db.stories.find(changes_query(cursor)).sort([("updated_at", 1), ("id", 1)]) \
+        .limit(limit + 1).to_list(limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_token = encode_sync_token(cursor.advance(docs))
+    return StoryChanges(
+        stories=[Story(**story) for story in stories_from_documents(docs, preview_chars(full))],
+        next_token=next_token,
+        has_more=has_more
+    )
+
+@api_router.get("/stories/changes", response_model=StoryChanges)
+async def get_story_changes(http_request: Request, since: Optional[str] = None, wait: float = 0,
+                            full: bool = False):
+    """Stories created or updated since the sync token.
+
+    With wait > 0 this long-polls: the response is held until something
+    changes or the wait runs out, so clients need not poll on a timer.
+    """
+    try:
+        changes = await fetch_story_changes(since, full)
+        remaining = min(wait, STORY_SYNC_MAX_WAIT_SECONDS)
+        loop = asyncio.get_running_loop()
+        wait_until = loop.time() + remaining
+        while since and not changes.stories and remaining > 0:
+            await story_changes.wait(min(remaining, STORY_SYNC_POLL_SECONDS))
+            if await http_request.is_disconnected():
+                break
+            changes = await fetch_story_changes(since, full)
+            remaining = wait_until - loop.time()
+        return changes
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error retrieving story changes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error retrieving story changes: {str(e)}")
+
+@api_router.get("/stories/changes/stream")
+async def stream_story_changes(http_request: Request, since: Optional[str] = None, full: bool = False):
+    """Server-sent events carrying the same payload as /stories/changes."""
+    async def events():
+        token = since
+        # Without a token the first event is the initial snapshot, even if it is empty
+        announced = since is not None
+        while not await http_request.is_disconnected():
+            changes = await fetch_story_changes(token, full)
+            token = changes.next_token
+            if changes.stories or not announced:
+                announced = True
+                yield f"event: stories\ndata: {changes.json()}\n\n"
+            if changes.has_more:
+                continue
+            if not await story_changes.wait(STORY_SYNC_POLL_SECONDS):
+                # Keep proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @api_router.get("/story/{story_id}", response_model=Story)
 async def get_story(story_id: str):
     try:
         story = await db.stories.find_one({"id": story_id})
         if not story:
             raise HTTPException(status_code=404, detail="Story not found")
-        return Story(**story)
+        return Story(**story_from_document(story))
     except Exception as e:
         logging.error(f"Error retrieving story: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error retrieving story: {str(e)}")
@@ -374,13 +625,55 @@ async def create_status_check(input: StatusCheckCreate):
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+async def get_status_checks(limit: int = 100, before: Optional[datetime] = None):
+    """Newest status checks first; pass the oldest timestamp seen as `before` for the next page."""
+    query = {"timestamp": {"$lt": before}} if before else {}
+    limit = max(1, min(limit, STATUS_CHECK_PAGE_LIMIT))
+    status_checks = await db.status_checks.find(query).sort("timestamp", -1).limit(limit).to_list(limit)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+@api_router.get("/status/summary")
+async def get_status_summary():
+    """Check counts and latest timestamp per client, computed inside MongoDB."""
+    summary = await db.status_checks.aggregate([
+        {"$group": {"_id": "$client_name", "count": {"$sum": 1}, "last_seen": {"$max": "$timestamp"}}},
+        {"$sort": {"last_seen": -1}}
+    ]).to_list(STATUS_CHECK_PAGE_LIMIT)
+    return [
+        {"client_name": row["_id"], "count": row["count"], "last_seen": row["last_seen"]}
+        for row in summary
+    ]
+
+# Probe routes: constant cost, never touch application collections
+@api_router.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@api_router.get("/readyz")
+async def readyz():
+    async with readiness_lock:
+        # Concurrent probes wait here and reuse the result of a single ping
+        if time.monotonic() - readiness["checked_at"] > settings.readiness_cache_seconds:
+            try:
+                await asyncio.wait_for(client.admin.command("ping"), timeout=2)
+                readiness["ready"] = True
+            except Exception as e:
+                # Logged rather than returned: this route is unauthenticated
+                logger.error(f"Readiness check failed: {str(e)}")
+                readiness["ready"] = False
+            readiness["checked_at"] = time.monotonic()
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content={"status": "unavailable"})
+    return {"status": "ready"}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(ProfilingMiddleware, profiler=profiler,
+                   get_admin_token=lambda: settings.admin_token if settings else None)
+
+app.add_middleware(AdmissionMiddleware, limiters=admission_limiters)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -396,6 +689,4 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+IMPORT_FINISHED = time.monotonic()
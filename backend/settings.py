@@ -0,0 +1,37 @@
+import os
+from typing import Optional
+
+
+class Settings:
+    """Server configuration, read from the environment when a worker starts.
+
+    Built in the app's lifespan rather than at import, so importing server.py
+    has no configuration side effects and a bad value fails worker startup
+    with a clear error instead of an import crash.
+    """
+
+    def __init__(self, mongo_url: str, db_name: str, openai_api_key: Optional[str] = None,
+                 gemini_api_key: Optional[str] = None, admin_token: Optional[str] = None,
+                 status_check_ttl_seconds: int = 7 * 24 * 3600, readiness_cache_seconds: float = 5.0):
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.openai_api_key = openai_api_key
+        self.gemini_api_key = gemini_api_key
+        # Admin-only routes (profiles) are disabled unless a token is configured
+        self.admin_token = admin_token
+        # Status checks expire after this long
+        self.status_check_ttl_seconds = status_check_ttl_seconds
+        # Readiness probes reuse the last Mongo ping for this long
+        self.readiness_cache_seconds = readiness_cache_seconds
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            mongo_url=os.environ['MONGO_URL'],
+            db_name=os.environ['DB_NAME'],
+            openai_api_key=os.environ.get('OPENAI_API_KEY'),
+            gemini_api_key=os.environ.get('GEMINI_API_KEY'),
+            admin_token=os.environ.get('ADMIN_TOKEN') or None,
+            status_check_ttl_seconds=int(os.environ.get('STATUS_CHECK_TTL_SECONDS', str(7 * 24 * 3600))),
+            readiness_cache_seconds=float(os.environ.get('READINESS_CACHE_SECONDS', '5')),
+        )
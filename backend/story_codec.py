@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import zlib
+from functools import lru_cache
+from typing import Optional
+
+from bson import Binary
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+# What a corrupt or inconsistent stored document can raise while being decoded
+DECODE_ERRORS = (ValueError, TypeError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+# Settings are read from the environment on use, so it does not matter whether
+# .env was loaded before or after this module was imported:
+#   STORY_CONTENT_CODEC  codec for new writes: "zlib" (default), "zstd" or "none"
+#   STORY_CONTENT_DICT   optional shared dictionary for new writes, a <id>.dict file
+#                        written by migrate_story_content.py --train-dict
+#   STORY_CONTENT_LEVEL  compression level (default 6)
+# Dictionaries are named by id and older ones are kept next to the current one,
+# so stories compressed before a dictionary was retrained stay readable.
+
+
+def dictionary_id(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+@lru_cache(maxsize=None)
+def _read_dictionary(path: str):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, dictionary_id(data)
+
+
+def current_dictionary():
+    """The dictionary used for new writes and its id, or (None, None)."""
+    path = os.environ.get('STORY_CONTENT_DICT')
+    if not path or not os.path.exists(path):
+        return None, None
+    return _read_dictionary(path)
+
+
+def _dictionary_by_id(dict_id: str) -> bytes:
+    data, current_id = current_dictionary()
+    if dict_id == current_id:
+        return data
+    path = os.environ.get('STORY_CONTENT_DICT')
+    if path:
+        candidate = os.path.join(os.path.dirname(path), f"{dict_id}.dict")
+        if os.path.exists(candidate):
+            return _read_dictionary(candidate)[0]
+    raise ValueError(f"Story content was compressed with unknown dictionary {dict_id}")
+
+
+def current_codec() -> str:
+    """The codec used for new writes."""
+    codec = os.environ.get('STORY_CONTENT_CODEC', 'zlib')
+    if codec == 'zstd' and zstandard is None:
+        logging.warning("zstandard is not installed, falling back to zlib for story content")
+        return 'zlib'
+    return codec
+
+
+def _level() -> int:
+    return int(os.environ.get('STORY_CONTENT_LEVEL', '6'))
+
+
+def compress_content(content: str) -> dict:
+    """Return the document fields used to store story content at rest."""
+    codec = current_codec()
+    dict_data, dict_id = current_dictionary()
+    raw = content.encode('utf-8')
+    if codec == 'zstd':
+        params = {'level': _level()}
+        if dict_data:
+            params['dict_data'] = zstandard.ZstdCompressionDict(dict_data)
+        data = zstandard.ZstdCompressor(**params).compress(raw)
+    elif codec == 'zlib':
+        if dict_data:
+            compressor = zlib.compressobj(_level(), zdict=dict_data)
+        else:
+            compressor = zlib.compressobj(_level())
+        data = compressor.compress(raw) + compressor.flush()
+    else:
+        return {"content": content}
+
+    fields = {"content": Binary(data), "content_codec": codec}
+    if dict_data:
+        fields["content_dict"] = dict_id
+    return fields
+
+
+def decompress_content(doc: dict, max_chars: Optional[int] = None) -> str:
+    """Decode the stored content of a story document.
+
+    With max_chars only enough of the stream to produce that many characters
+    is inflated, which is all callers like language detection need.
+    """
+    content = doc.get("content")
+    codec = doc.get("content_codec")
+    if codec is None:
+        return content if max_chars is None else content[:max_chars]
+
+    zdict = _dictionary_by_id(doc["content_dict"]) if doc.get("content_dict") else None
+    # UTF-8 is at most 4 bytes per character
+    max_length = max_chars * 4 if max_chars is not None else 0
+
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("Story content is zstd-compressed but zstandard is not installed")
+        params = {'dict_data': zstandard.ZstdCompressionDict(zdict)} if zdict else {}
+        reader = zstandard.ZstdDecompressor(**params).stream_reader(bytes(content))
+        raw = reader.read(max_length) if max_length else reader.read()
+    elif codec == 'zlib':
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        raw = decompressor.decompress(bytes(content), max_length)
+    else:
+        raise ValueError(f"Unknown story content codec: {codec}")
+
+    text = raw.decode('utf-8', errors='ignore' if max_length else 'strict')
+    return text if max_chars is None else text[:max_chars]
+
+
+def story_to_document(story_dict: dict) -> dict:
+    """Prepare a Story dict for insertion, compressing its content."""
+    doc = dict(story_dict)
+    doc.update(compress_content(doc["content"]))
+    return doc
+
+
+def story_from_document(doc: dict, max_chars: Optional[int] = None) -> dict:
+    """Turn a stored story document back into Story fields.
+
+    With max_chars the content is only a preview of that many characters.
+    """
+    story = {k: v for k, v in doc.items() if k not in ("_id", "content_codec", "content_dict")}
+    story["content"] = decompress_content(doc, max_chars)
+    return story
+
+
+def stories_from_documents(docs: list, max_chars: Optional[int] = None) -> list:
+    """Story fields for a list of documents, skipping (and logging) any that cannot be decoded.
+
+    One unreadable row, e.g. a dictionary missing on this host, should not
+    fail the whole story list.
+    """
+    stories = []
+    for doc in docs:
+        try:
+            stories.append(story_from_document(doc, max_chars))
+        except DECODE_ERRORS as e:
+            logging.error(f"Skipping story {doc.get('id')}: {str(e)}")
+    return stories
+
+
+def train_dictionary(samples: list, size: int = 32 * 1024) -> bytes:
+    """Build a shared dictionary from existing story texts.
+
+    zstd trains a proper dictionary; for zlib the preset dictionary is simply
+    the most representative text, filling its 32KB window with recent stories.
+    """
+    encoded = [s.encode('utf-8') for s in samples if s]
+    if zstandard is not None and current_codec() == 'zstd':
+        return zstandard.train_dictionary(size, encoded).as_bytes()
+    # zlib favours matches near the end of the dictionary, so put newest stories last
+    return b"\n".join(reversed(encoded))[-size:]
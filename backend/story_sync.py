@@ -0,0 +1,119 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+
+# updated_at is stamped by MongoDB ($$NOW) so every worker shares one clock, but
+# writes can still commit in a different order than their stamps. Each sync
+# re-reads this far behind the newest change it has returned and skips the
+# versions the client already has, so a late commit is picked up rather than lost.
+STORY_SYNC_LOOKBACK = timedelta(seconds=float(os.environ.get('STORY_SYNC_LOOKBACK_SECONDS', '10')))
+EPOCH = datetime(1970, 1, 1)
+
+
+class SyncCursor:
+    """Decoded sync token: newest updated_at returned so far, plus the
+    (story id, updated_at) versions returned within the lookback window."""
+
+    def __init__(self, high_water: datetime = EPOCH, seen: Optional[Set[Tuple[str, str]]] = None):
+        self.high_water = high_water
+        self.seen = seen or set()
+
+    def advance(self, docs: list, lookback: timedelta = STORY_SYNC_LOOKBACK) -> "SyncCursor":
+        high_water = max([self.high_water] + [doc["updated_at"] for doc in docs])
+        floor = high_water - lookback
+        seen = {(story_id, stamp) for story_id, stamp in self.seen if datetime.fromisoformat(stamp) >= floor}
+        seen |= {(doc["id"], doc["updated_at"].isoformat()) for doc in docs if doc["updated_at"] >= floor}
+        return SyncCursor(high_water, seen)
+
+
+def encode_sync_token(cursor: SyncCursor) -> str:
+    raw = json.dumps({"t": cursor.high_water.isoformat(), "s": sorted(f"{i}|{t}" for i, t in cursor.seen)})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_sync_token(token: str) -> SyncCursor:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        seen = {tuple(entry.split("|", 1)) for entry in raw["s"]}
+        for _, stamp in seen:
+            datetime.fromisoformat(stamp)
+        return SyncCursor(datetime.fromisoformat(raw["t"]), seen)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+def changes_query(cursor: SyncCursor, lookback: timedelta = STORY_SYNC_LOOKBACK) -> dict:
+    """Story versions in the lookback window that the client has not been sent yet."""
+    query = {"updated_at": {"$gte": cursor.high_water - lookback}}
+    if cursor.seen:
+        query["$nor"] = [{"id": story_id, "updated_at": datetime.fromisoformat(stamp)}
+                         for story_id, stamp in sorted(cursor.seen)]
+    return query
+
+
+def server_stamped(fields: dict) -> list:
+    """Update pipeline setting the fields verbatim and updated_at to MongoDB's clock."""
+    stage = {key: {"$literal": value} for key, value in fields.items() if key != "updated_at"}
+    stage["updated_at"] = "$$NOW"
+    return [{"$set": stage}]
+
+
+class StoryChangeNotifier:
+    """Wakes up long-poll and SSE waiters when a story is written.
+
+    Writes made by this worker notify directly. When MongoDB runs as a replica
+    set, a change stream also relays writes made by other workers.
+    """
+
+    def __init__(self):
+        self._event: Optional[asyncio.Event] = None
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        # Wake everyone currently waiting; the next waiter arms a fresh event
+        if self._event is not None:
+            self._event.set()
+            self._event = None
+
+    async def wait(self, timeout: float) -> bool:
+        if self._event is None:
+            self._event = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def start(self, client, collection):
+        try:
+            hello = await client.admin.command("hello")
+        except Exception as e:
+            logging.warning(f"Could not check for replica set, story change streams disabled: {str(e)}")
+            return
+        if "setName" not in hello:
+            logging.info("MongoDB is not a replica set, story changes are only relayed within this worker")
+            return
+        self._watch_task = asyncio.create_task(self._watch(collection))
+
+    async def _watch(self, collection):
+        while True:
+            try:
+                async with collection.watch([{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]) as stream:
+                    async for _ in stream:
+                        self.notify()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Story change stream failed, retrying: {str(e)}")
+                await asyncio.sleep(5)
+
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+WRITE_BUFFER_MAX_BATCH = int(os.environ.get('WRITE_BUFFER_MAX_BATCH', '100'))
+WRITE_BUFFER_MAX_DELAY_SECONDS = float(os.environ.get('WRITE_BUFFER_MAX_DELAY_MS', '5')) / 1000
+# Writers wait for room once this many operations are queued
+WRITE_BUFFER_MAX_QUEUED = int(os.environ.get('WRITE_BUFFER_MAX_QUEUED', '10000'))
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    """Gathers MongoDB writes for a few milliseconds and commits them as bulk_write batches.
+
+    Writers choose their durability: wait=True returns once the batch holding
+    the write is acknowledged (and raises if it failed); wait=False returns as
+    soon as the write is queued and failures are only logged.
+    """
+
+    def __init__(self, max_batch: int = WRITE_BUFFER_MAX_BATCH,
+                 max_delay: float = WRITE_BUFFER_MAX_DELAY_SECONDS):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._db = None
+        self._on_flush: Optional[Callable[[str], None]] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.operations = 0
+        self.failed_operations = 0
+        self.max_batch_size = 0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def start(self, db, on_flush: Optional[Callable[[str], None]] = None):
+        self._db = db
+        self._on_flush = on_flush
+        self._queue = asyncio.Queue(maxsize=WRITE_BUFFER_MAX_QUEUED)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything already queued, then stop the flusher."""
+        if self._task is None:
+            return
+        self._ensure_running()
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def insert(self, collection: str, document: dict, wait: bool = True):
+        await self._enqueue(collection, InsertOne(document), wait)
+
+    async def update(self, collection: str, filter: dict, update, wait: bool = False, upsert: bool = False):
+        await self._enqueue(collection, UpdateOne(filter, update, upsert=upsert), wait)
+
+    def _ensure_running(self):
+        if self._task is None:
+            raise RuntimeError("Write buffer is not running")
+        if self._task.done():
+            # _run() only exits on stop(); anything else is a bug, so log it and keep writes flowing
+            error = None if self._task.cancelled() else self._task.exception()
+            logger.error(f"Write buffer flusher died ({error!r}), restarting it")
+            self._task = asyncio.create_task(self._run())
+
+    async def _enqueue(self, collection: str, operation, wait: bool):
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((collection, operation, future))
+        if wait:
+            await future
+        else:
+            future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Buffered write failed: {future.exception()}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            flush_at = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = flush_at - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.exception("Write buffer flush failed")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _flush(self, batch):
+        by_collection = {}
+        for collection, operation, future in batch:
+            by_collection.setdefault(collection, []).append((operation, future))
+
+        for collection, entries in by_collection.items():
+            started = time.monotonic()
+            # Unordered: writes from unrelated requests must not fail each other. Writers that
+            # depend on an earlier write (TTS updating a story) only start after it committed.
+            try:
+                await self._db[collection].bulk_write([operation for operation, _ in entries], ordered=False)
+                errors = {}
+            except BulkWriteError as e:
+                errors = self._bulk_write_errors(e.details, len(entries))
+            except Exception as e:
+                errors = {index: e for index in range(len(entries))}
+            elapsed = time.monotonic() - started
+
+            for index, (_, future) in enumerate(entries):
+                if future.done():
+                    continue
+                if index in errors:
+                    future.set_exception(errors[index])
+                else:
+                    future.set_result(None)
+
+            self.batches += 1
+            self.operations += len(entries)
+            self.failed_operations += len(errors)
+            self.max_batch_size = max(self.max_batch_size, len(entries))
+            self.total_flush_seconds += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            if self._on_flush and len(errors) < len(entries):
+                try:
+                    self._on_flush(collection)
+                except Exception:
+                    logger.exception(f"Write buffer on_flush callback failed for {collection}")
+
+    @staticmethod
+    def _bulk_write_errors(details: dict, count: int) -> dict:
+        """Map a BulkWriteError to an exception per failed operation index."""
+        # An unordered bulk write attempts every operation and reports each failure by index
+        write_errors = details.get("writeErrors") or []
+        errors = {error["index"]: RuntimeError(error.get("errmsg", "Write error")) for error in write_errors}
+        concern_errors = details.get("writeConcernErrors") or []
+        if concern_errors or not write_errors:
+            # The rest were applied but the write concern was not met, so they may not be durable
+            message = concern_errors[0].get("errmsg", "unknown") if concern_errors else "unknown"
+            for index in range(count):
+                errors.setdefault(index, RuntimeError(f"Write concern error: {message}"))
+        return errors
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "operations": self.operations,
+            "failed_operations": self.failed_operations,
+            "avg_batch_size": round(self.operations / self.batches, 2) if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "avg_flush_ms": round(self.total_flush_seconds / self.batches * 1000, 2) if self.batches else 0,
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 2),
+        }
@@ -21,6 +21,7 @@ function App() {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [passwordError, setPasswordError] = useState("");
   const audioRef = useRef(null);
+  const syncTokenRef = useRef(null);
   const storyContentRef = useRef(null);
 
   // Fetch previous stories on component mount
@@ -31,8 +32,9 @@ function App() {
   const fetchStories = async () => {
     try {
       setLoading(true);
-      const response = await axios.get(`${API}/stories`);
-      setPreviousStories(response.data);
+      const response = await axios.get(`${API}/stories/changes`);
+      syncTokenRef.current = response.data.next_token;
+      setPreviousStories(sortStories(response.data.stories));
       setLoading(false);
     } catch (err) {
       console.error("Error fetching stories:", err);
@@ -41,6 +43,38 @@ function App() {
     }
   };
 
+  // Newest first, limited to the 20 most recent like the full story list
+  const sortStories = (stories) =>
+    [...stories]
+      .sort((a, b) => new Date(b.created_at) - new Date(a.created_at))
+      .slice(0, 20);
+
+  // Pull only stories created or updated since the last sync
+  const syncStories = async () => {
+    if (!syncTokenRef.current) {
+      return fetchStories();
+    }
+    try {
+      let hasMore = true;
+      while (hasMore) {
+        const response = await axios.get(`${API}/stories/changes`, {
+          params: { since: syncTokenRef.current }
+        });
+        const changed = response.data.stories;
+        syncTokenRef.current = response.data.next_token;
+        hasMore = response.data.has_more;
+        if (changed.length > 0) {
+          setPreviousStories(prev => {
+            const changedIds = new Set(changed.map(story => story.id));
+            return sortStories([...changed, ...prev.filter(story => !changedIds.has(story.id))]);
+          });
+        }
+      }
+    } catch (err) {
+      console.error("Error syncing stories:", err);
+    }
+  };
+
   const generateStory = async (e) => {
     e.preventDefault();
     
@@ -78,8 +112,8 @@ function App() {
       
       setCurrentStory(response.data);
       
-      // Refresh the story list
-      fetchStories();
+      // Pick up the new story without re-downloading the whole list
+      syncStories();
       
       // Small delay to show completed progress bar before resetting
       setTimeout(() => {
@@ -125,13 +159,20 @@ function App() {
     }
   };
 
-  const loadStory = (story) => {
+  const loadStory = async (story) => {
     // Stop audio if playing when switching stories
     if (isPlaying && audioRef.current) {
       audioRef.current.pause();
       setIsPlaying(false);
     }
-    setCurrentStory(story);
+    // The list only carries the start of each story; fetch the full text
+    try {
+      const response = await axios.get(`${API}/story/${story.id}`);
+      setCurrentStory(response.data);
+    } catch (err) {
+      console.error("Error loading story:", err);
+      setError("Failed to load story. Please try again.");
+    }
   };
 
   // Login handling function
@@ -0,0 +1,97 @@
+import asyncio
+
+import admission
+from admission import AdaptiveLimiter
+
+
+def limiter(initial=2, target_latency=1.0):
+    return AdaptiveLimiter("/api/generate-story", initial=initial, min=1, max=32, target_latency=target_latency)
+
+
+def test_limit_grows_only_when_saturated():
+    route = limiter(initial=4)
+
+    async def main():
+        await route.acquire()
+        route.release(0.1, ok=True)
+        assert route.limit == 4
+
+        for _ in range(4):
+            await route.acquire()
+        route.release(0.1, ok=True)
+        assert route.limit == 4.25
+
+    asyncio.run(main())
+
+
+def test_slow_response_cuts_limit_once_per_window():
+    route = limiter(initial=8)
+
+    async def main():
+        for _ in range(3):
+            await route.acquire()
+        for _ in range(3):
+            route.release(5.0, ok=True)
+
+    asyncio.run(main())
+    assert route.limit == 8 * admission.BACKOFF_FACTOR
+
+
+def test_queued_request_gets_released_slot():
+    route = limiter(initial=1)
+
+    async def main():
+        assert await route.acquire()
+        waiting = asyncio.ensure_future(route.acquire())
+        await asyncio.sleep(0)
+        assert route.stats()["queued"] == 1
+        route.release(0.1, ok=True)
+        assert await waiting
+        assert route.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_rejects(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_TIMEOUT_SECONDS", 0.01)
+    route = limiter(initial=1)
+
+    async def main():
+        await route.acquire()
+        assert not await route.acquire()
+
+    asyncio.run(main())
+    assert route.in_flight == 1
+    assert route.rejected == 1
+
+
+def test_slot_handed_over_at_timeout_is_given_back(monkeypatch):
+    route = limiter(initial=1)
+
+    async def handed_then_timed_out(waiter, timeout):
+        # The slot arrives in the same loop iteration as the timeout
+        route.release(0.1, ok=True)
+        raise asyncio.TimeoutError
+
+    monkeypatch.setattr(admission.asyncio, "wait_for", handed_then_timed_out)
+
+    async def main():
+        await route.acquire()
+        assert not await route.acquire()
+
+    asyncio.run(main())
+    assert route.in_flight == 0
+    assert route.stats()["queued"] == 0
+
+
+def test_full_queue_is_shed(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_SIZE", 0)
+    route = limiter(initial=1)
+
+    async def main():
+        await route.acquire()
+        assert not await route.acquire()
+
+    asyncio.run(main())
+    assert route.rejected == 1
+    assert route.retry_after() >= 1
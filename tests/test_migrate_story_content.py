@@ -0,0 +1,62 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+import migrate_story_content
+import story_codec
+from tests.test_story_codec import STORY, write_dictionary
+
+
+def migrate_one(doc):
+    db = AsyncMongoMockClient()["stories_test"]
+
+    async def main():
+        await db.stories.insert_one(doc)
+        await migrate_story_content.migrate(db, batch_size=10)
+        return await db.stories.find_one({"id": doc["id"]})
+
+    return asyncio.run(main())
+
+
+def test_switching_to_none_stores_plain_text(monkeypatch, tmp_path):
+    monkeypatch.setenv("STORY_CONTENT_CODEC", "zlib")
+    monkeypatch.setenv("STORY_CONTENT_DICT", write_dictionary(tmp_path, "a little dragon could not sleep"))
+    doc = story_codec.story_to_document({"id": "s1", "content": STORY})
+
+    monkeypatch.setenv("STORY_CONTENT_CODEC", "none")
+    monkeypatch.setenv("STORY_CONTENT_DICT", write_dictionary(tmp_path, "a brave bunny hopped home"))
+    migrated = migrate_one(doc)
+
+    assert migrated["content"] == STORY
+    assert "content_codec" not in migrated
+    assert "content_dict" not in migrated
+    assert story_codec.story_from_document(migrated)["content"] == STORY
+
+
+def test_plain_text_is_compressed(monkeypatch):
+    monkeypatch.setenv("STORY_CONTENT_CODEC", "zlib")
+    monkeypatch.delenv("STORY_CONTENT_DICT", raising=False)
+    migrated = migrate_one({"id": "s1", "content": STORY})
+
+    assert migrated["content_codec"] == "zlib"
+    assert story_codec.story_from_document(migrated)["content"] == STORY
+
+
+def test_up_to_date_stories_are_not_selected(monkeypatch):
+    monkeypatch.setenv("STORY_CONTENT_CODEC", "zlib")
+    monkeypatch.delenv("STORY_CONTENT_DICT", raising=False)
+    current = story_codec.story_to_document({"id": "s1", "content": STORY})
+    query = migrate_story_content.outdated_query()
+
+    async def main():
+        db = AsyncMongoMockClient()["stories_test"]
+        await db.stories.insert_one(current)
+        return await db.stories.count_documents(query)
+
+    assert asyncio.run(main()) == 0
+
+
+def test_inconsistent_rows_are_skipped_in_lists():
+    broken = {"id": "broken", "content": STORY, "content_codec": "zlib"}
+    stories = story_codec.stories_from_documents([broken, {"id": "fine", "content": STORY}])
+    assert [story["id"] for story in stories] == ["fine"]
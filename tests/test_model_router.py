@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import model_router
+from model_router import DEFAULT_ROUTES, ModelRouter, is_failure
+
+GEMINI = [
+    {"provider": "gemini", "model": "fast", "cost": 1.0},
+    {"provider": "gemini", "model": "cheap", "cost": 0.5},
+]
+
+
+def call(router, task, statuses):
+    """Route one call; statuses maps model name to the status (or status and body) it answers with."""
+    tried = []
+
+    async def send(backend):
+        tried.append(backend.model)
+        answer = statuses.get(backend.model, 200)
+        status, body = answer if isinstance(answer, tuple) else (answer, "")
+        return httpx.Response(status, text=body)
+
+    response = asyncio.run(router.call(task, send))
+    return response.status_code, tried
+
+
+@pytest.mark.parametrize("status", [403, 404, 429, 500, 503])
+def test_rejected_calls_fall_back(status):
+    assert is_failure(httpx.Response(status))
+    router = ModelRouter({"story": GEMINI})
+    assert call(router, "story", {"fast": status}) == (200, ["fast", "cheap"])
+
+
+def test_bad_request_is_returned_without_fallback():
+    router = ModelRouter(DEFAULT_ROUTES)
+    too_long = (400, '{"error": {"message": "string too long. Expected a string with maximum length 4096"}}')
+    assert call(router, "tts", {"tts-1": too_long}) == (400, ["tts-1"])
+    # Says nothing about backend health
+    assert all(backend.calls == 0 and backend.error_rate == 0 for backend in router.backends["tts"])
+
+
+def test_bad_request_naming_the_model_falls_back():
+    router = ModelRouter({"story": GEMINI})
+    unsupported = (400, '{"error": {"message": "fast does not support this generation config"}}')
+    assert call(router, "story", {"fast": unsupported}) == (200, ["fast", "cheap"])
+    assert router.backends["story"][0].failures == 1
+
+
+def test_success_is_not_a_failure():
+    assert not is_failure(httpx.Response(200))
+    assert not is_failure(httpx.Response(401))
+
+
+def test_unmeasured_backends_keep_configured_order():
+    router = ModelRouter(DEFAULT_ROUTES)
+    assert [b.model for b in router.ranked("detect")] == ["gemini-1.5-flash", "gemini-1.5-flash-8b"]
+    assert [b.model for b in router.ranked("story")] == ["gemini-1.5-flash", "gemini-1.5-pro"]
+
+
+def test_measured_backend_ranks_before_unmeasured_ones():
+    router = ModelRouter({"story": GEMINI})
+    router.backends["story"][1].record(0.5, ok=True)
+    assert [b.model for b in router.ranked("story")] == ["cheap", "fast"]
+    assert router.snapshot()["tasks"]["story"][1]["score"] is None
+
+
+def test_no_exploration_by_default(monkeypatch):
+    monkeypatch.setattr(model_router.random, "random", lambda: 0.0)
+    router = ModelRouter({"story": GEMINI})
+    assert [b.model for b in router.ranked("story")] == ["fast", "cheap"]
+
+
+def test_every_backend_failing_returns_last_response():
+    router = ModelRouter({"story": GEMINI})
+    assert call(router, "story", {"fast": 503, "cheap": 404}) == (404, ["fast", "cheap"])
+
+
+@pytest.mark.parametrize("routes", [
+    {"story": [{"provider": "openai", "model": "gpt-4o"}]},
+    {"tts": [{"provider": "gemini", "model": "gemini-1.5-flash"}]},
+    {"summarize": GEMINI},
+    {"story": []},
+])
+def test_invalid_routes_are_rejected(routes, monkeypatch):
+    with pytest.raises(ValueError):
+        ModelRouter(routes)
+    monkeypatch.setenv("MODEL_ROUTES", json.dumps(routes))
+    with pytest.raises(ValueError):
+        ModelRouter.from_env()
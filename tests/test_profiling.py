@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+from profiling import LoopLagMonitor, ProfilingMiddleware, SamplingProfiler
+
+
+def run_profiled(app, max_duration):
+    profiler = SamplingProfiler()
+    middleware = ProfilingMiddleware(app, profiler, get_admin_token=lambda: "secret", max_duration=max_duration)
+    scope = {"type": "http", "method": "GET", "path": "/api/stories/changes/stream",
+             "headers": [(b"x-profile", b"1"), (b"x-admin-token", b"secret")]}
+
+    async def send(message):
+        pass
+
+    asyncio.run(middleware(scope, None, send))
+    return profiler
+
+
+def test_long_response_profile_is_truncated():
+    async def streaming(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await asyncio.sleep(0.2)
+
+    profiler = run_profiled(streaming, max_duration=0.05)
+    [profile] = profiler.summaries()
+    assert profile["truncated"]
+    assert profile["duration"] < 0.2
+    assert profiler._active == {}
+
+
+def test_short_response_profile_is_complete():
+    async def quick(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    [profile] = run_profiled(quick, max_duration=5).summaries()
+    assert not profile["truncated"]
+
+
+def test_loop_lag_monitor_can_restart():
+    monitor = LoopLagMonitor(threshold=0.05)
+
+    async def block_loop():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)
+        await asyncio.sleep(0.05)
+        monitor.stop()
+
+    asyncio.run(block_loop())
+    asyncio.run(block_loop())
+    assert monitor.blocked_count == 2
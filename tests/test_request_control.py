@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import request_control
+from request_control import (DEFAULT_DEADLINE_SECONDS, MAX_DEADLINE_SECONDS, Deadline, cancellation_stats,
+                             run_until_disconnect)
+
+
+def request_with(headers):
+    return Request({"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+
+def test_default_deadline():
+    assert Deadline.from_request(request_with({})).seconds == DEFAULT_DEADLINE_SECONDS
+
+
+def test_header_is_capped():
+    deadline = Deadline.from_request(request_with({"X-Request-Timeout": str(MAX_DEADLINE_SECONDS * 10)}))
+    assert deadline.seconds == MAX_DEADLINE_SECONDS
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf", "0", "-5", "soon"])
+def test_invalid_header_is_rejected(value):
+    with pytest.raises(HTTPException) as error:
+        Deadline.from_request(request_with({"X-Request-Timeout": value}))
+    assert error.value.status_code == 400
+
+
+class FakeRequest:
+    """Just enough of a Request for run_until_disconnect: disconnects after `after` seconds."""
+
+    def __init__(self, after=None):
+        self.headers = {}
+        self.after = after
+        self.started = None
+
+    async def is_disconnected(self):
+        loop = asyncio.get_running_loop()
+        if self.started is None:
+            self.started = loop.time()
+        return self.after is not None and loop.time() - self.started >= self.after
+
+
+def run_work(request, seconds, deadline_seconds, monkeypatch, name="test_work"):
+    """Run work sleeping `seconds`; returns (result or HTTPException, whether the work was cancelled)."""
+    monkeypatch.setattr(request_control, "DISCONNECT_POLL_SECONDS", 0.01)
+    state = {"cancelled": False}
+
+    async def work():
+        try:
+            await asyncio.sleep(seconds)
+            return "done"
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def main():
+        try:
+            result = await run_until_disconnect(request, work(), Deadline(deadline_seconds), name)
+        except HTTPException as e:
+            result = e
+        # Let the cancelled task run its except block
+        await asyncio.sleep(0.01)
+        return result
+
+    return asyncio.run(main()), state["cancelled"]
+
+
+def test_finished_work_is_returned(monkeypatch):
+    result, cancelled = run_work(FakeRequest(), 0, 1, monkeypatch)
+    assert result == "done"
+    assert not cancelled
+
+
+def test_client_disconnect_cancels_work(monkeypatch):
+    before = cancellation_stats["test_work.client_disconnected"]
+    result, cancelled = run_work(FakeRequest(after=0.02), 5, 10, monkeypatch)
+    assert isinstance(result, HTTPException) and result.status_code == 499
+    assert cancelled
+    assert cancellation_stats["test_work.client_disconnected"] == before + 1
+
+
+def test_deadline_cancels_work(monkeypatch):
+    before = cancellation_stats["test_work.deadline_exceeded"]
+    result, cancelled = run_work(FakeRequest(), 5, 0.05, monkeypatch)
+    assert isinstance(result, HTTPException) and result.status_code == 504
+    assert cancelled
+    assert cancellation_stats["test_work.deadline_exceeded"] == before + 1
+
+
+def test_deadline_raised_by_work_is_counted(monkeypatch):
+    before = cancellation_stats["test_work.deadline_exceeded"]
+
+    async def main():
+        deadline = Deadline(0.01)
+        await asyncio.sleep(0.02)
+
+        async def work():
+            deadline.timeout()
+
+        with pytest.raises(HTTPException) as error:
+            await run_until_disconnect(FakeRequest(), work(), Deadline(1), "test_work")
+        return error.value.status_code
+
+    assert asyncio.run(main()) == 504
+    assert cancellation_stats["test_work.deadline_exceeded"] == before + 1
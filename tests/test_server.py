@@ -0,0 +1,210 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from model_router import DEFAULT_ROUTES, ModelRouter
+from request_control import cancellation_stats
+from settings import Settings
+from story_codec import story_to_document
+
+
+class FakeRequest:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+    async def is_disconnected(self):
+        return False
+
+
+def upstream(request):
+    if "openai" in str(request.url):
+        return httpx.Response(200, content=b"A" * 64 * 1024)
+    return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "English"}]}}]})
+
+
+def with_server(scenario, monkeypatch):
+    """Run scenario() against the app's globals, backed by mongomock-motor and a mocked upstream."""
+    monkeypatch.setattr(server, "settings", Settings("mongodb://unused", "storytime_test", readiness_cache_seconds=60))
+    monkeypatch.setattr(server, "model_router", ModelRouter(DEFAULT_ROUTES))
+    monkeypatch.setattr(server, "client", AsyncMongoMockClient())
+    monkeypatch.setattr(server, "db", server.client["storytime_test"])
+
+    async def main():
+        monkeypatch.setattr(server, "http_client", httpx.AsyncClient(transport=httpx.MockTransport(upstream)))
+        monkeypatch.setattr(server, "readiness_lock", asyncio.Lock())
+        server.write_buffer.start(server.db)
+        try:
+            return await scenario()
+        finally:
+            await server.write_buffer.stop()
+            await server.http_client.aclose()
+
+    return asyncio.run(main())
+
+
+def test_abandoned_audio_stream_is_counted(monkeypatch):
+    async def scenario():
+        await server.db.stories.insert_one(story_to_document({"id": "s1", "prompt": "cat", "duration": 5,
+                                                              "content": "Title\nOnce upon a time"}))
+        response = await server.text_to_speech(FakeRequest(), {"story_id": "s1"})
+        body = response.body_iterator
+        await body.__anext__()
+        # The listener goes away after the first chunk
+        await body.aclose()
+
+    before = cancellation_stats["text_to_speech.stream_cancelled"]
+    with_server(scenario, monkeypatch)
+    assert cancellation_stats["text_to_speech.stream_cancelled"] == before + 1
+
+
+def test_completed_audio_stream_is_not_counted(monkeypatch):
+    async def scenario():
+        await server.db.stories.insert_one(story_to_document({"id": "s1", "prompt": "cat", "duration": 5,
+                                                              "content": "Title\nOnce upon a time"}))
+        response = await server.text_to_speech(FakeRequest(), {"story_id": "s1"})
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    before = cancellation_stats["text_to_speech.stream_cancelled"]
+    assert len(with_server(scenario, monkeypatch)) == 64 * 1024
+    assert cancellation_stats["text_to_speech.stream_cancelled"] == before
+
+
+def test_first_sync_lists_newest_created_stories(monkeypatch):
+    now = datetime(2024, 5, 1, 12)
+
+    def doc(story_id, created_minutes_ago, updated_seconds_ago):
+        return story_to_document({"id": story_id, "prompt": "p", "duration": 5, "content": "Title\nText",
+                                  "created_at": now - timedelta(minutes=created_minutes_ago),
+                                  "updated_at": now - timedelta(seconds=updated_seconds_ago)})
+
+    async def scenario():
+        await server.db.stories.insert_many([
+            doc("new", 1, 30),
+            doc("newer", 0, 20),
+            # Created long ago but just replayed, which bumped updated_at
+            doc("old", 60, 1),
+        ])
+        first = await server.fetch_story_changes(None, limit=2)
+        again = await server.fetch_story_changes(first.next_token)
+        await server.db.stories.update_one({"id": "new"}, {"$set": {"updated_at": now}})
+        later = await server.fetch_story_changes(again.next_token)
+        return first, again, later
+
+    first, again, later = with_server(scenario, monkeypatch)
+    assert [story.id for story in first.stories] == ["newer", "new"]
+    assert again.stories == []
+    assert [story.id for story in later.stories] == ["new"]
+
+
+def test_status_checks_are_paginated(monkeypatch):
+    monkeypatch.setattr(server, "STATUS_CHECK_PAGE_LIMIT", 3)
+    start = datetime(2024, 5, 1, 12)
+
+    async def scenario():
+        await server.db.status_checks.insert_many([
+            {"id": str(i), "client_name": "probe", "timestamp": start + timedelta(minutes=i)} for i in range(5)
+        ])
+        clamped = await server.get_status_checks(limit=50)
+        at_least_one = await server.get_status_checks(limit=0)
+        first = await server.get_status_checks(limit=2)
+        second = await server.get_status_checks(limit=2, before=first[-1].timestamp)
+        return clamped, at_least_one, first, second
+
+    clamped, at_least_one, first, second = with_server(scenario, monkeypatch)
+    assert [check.id for check in clamped] == ["4", "3", "2"]
+    assert [check.id for check in at_least_one] == ["4"]
+    assert [check.id for check in first] == ["4", "3"]
+    assert [check.id for check in second] == ["2", "1"]
+
+
+class FakeStatusChecks:
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.created = []
+
+    async def index_information(self):
+        return self.indexes
+
+    async def create_index(self, keys, **options):
+        self.created.append((keys, options))
+
+
+class FakeDB:
+    def __init__(self, indexes):
+        self.status_checks = FakeStatusChecks(indexes)
+        self.commands = []
+
+    async def command(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+
+def ensure_ttl(indexes, monkeypatch, ttl=3600):
+    monkeypatch.setattr(server, "settings", Settings("mongodb://unused", "storytime_test", status_check_ttl_seconds=ttl))
+    monkeypatch.setattr(server, "db", FakeDB(indexes))
+    asyncio.run(server.ensure_status_check_ttl())
+    return server.db
+
+
+def test_ttl_index_is_created_when_missing(monkeypatch):
+    db = ensure_ttl({"_id_": {"key": [("_id", 1)]}}, monkeypatch)
+    assert db.status_checks.created == [("timestamp", {"expireAfterSeconds": 3600})]
+    assert db.commands == []
+
+
+def test_changed_ttl_is_updated_with_collmod(monkeypatch):
+    db = ensure_ttl({"timestamp_1": {"key": [("timestamp", 1)], "expireAfterSeconds": 60}}, monkeypatch)
+    assert db.status_checks.created == []
+    assert db.commands == [(("collMod", "status_checks"),
+                            {"index": {"keyPattern": {"timestamp": 1}, "expireAfterSeconds": 3600}})]
+
+
+def test_unchanged_ttl_is_left_alone(monkeypatch):
+    db = ensure_ttl({"timestamp_1": {"key": [("timestamp", 1)], "expireAfterSeconds": 3600}}, monkeypatch)
+    assert db.status_checks.created == []
+    assert db.commands == []
+
+
+class FakeAdmin:
+    def __init__(self, error=None):
+        self.error = error
+        self.pings = 0
+
+    async def command(self, name):
+        self.pings += 1
+        if self.error:
+            raise self.error
+        return {"ok": 1}
+
+
+class FakeClient:
+    def __init__(self, admin):
+        self.admin = admin
+
+
+def probe(admin, monkeypatch, times=3):
+    monkeypatch.setattr(server, "readiness", {"ready": False, "checked_at": 0.0})
+
+    async def scenario():
+        monkeypatch.setattr(server, "client", FakeClient(admin))
+        return await asyncio.gather(*(server.readyz() for _ in range(times)))
+
+    return with_server(scenario, monkeypatch)
+
+
+def test_readyz_reuses_a_cached_ping(monkeypatch):
+    admin = FakeAdmin()
+    assert probe(admin, monkeypatch) == [{"status": "ready"}] * 3
+    assert admin.pings == 1
+
+
+def test_readyz_does_not_leak_the_error(monkeypatch):
+    admin = FakeAdmin(error=RuntimeError("auth failed for user storytime@10.0.0.5"))
+    responses = probe(admin, monkeypatch)
+    assert admin.pings == 1
+    for response in responses:
+        assert response.status_code == 503
+        assert json.loads(response.body) == {"status": "unavailable"}
@@ -0,0 +1,61 @@
+import story_codec
+
+STORY = "The Sleepy Dragon\n\nOnce upon a time, a little dragon could not fall asleep. " * 20
+
+
+def write_dictionary(directory, text):
+    data = story_codec.train_dictionary([text])
+    path = directory / f"{story_codec.dictionary_id(data)}.dict"
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_roundtrip_compresses_content(monkeypatch):
+    monkeypatch.setenv("STORY_CONTENT_CODEC", "zlib")
+    monkeypatch.delenv("STORY_CONTENT_DICT", raising=False)
+    doc = story_codec.story_to_document({"id": "s1", "content": STORY})
+    assert doc["content_codec"] == "zlib"
+    assert len(doc["content"]) < len(STORY)
+    assert story_codec.story_from_document(doc)["content"] == STORY
+
+
+def test_partial_decompression(monkeypatch):
+    monkeypatch.delenv("STORY_CONTENT_DICT", raising=False)
+    doc = story_codec.story_to_document({"id": "s1", "content": STORY})
+    assert story_codec.decompress_content(doc, max_chars=17) == "The Sleepy Dragon"
+
+
+def test_plain_documents_pass_through():
+    assert story_codec.story_from_document({"id": "s1", "content": STORY})["content"] == STORY
+
+
+def test_settings_read_at_call_time(monkeypatch):
+    monkeypatch.setenv("STORY_CONTENT_CODEC", "none")
+    assert story_codec.story_to_document({"id": "s1", "content": STORY})["content"] == STORY
+
+
+def test_old_dictionary_stays_readable_after_retraining(monkeypatch, tmp_path):
+    monkeypatch.setenv("STORY_CONTENT_DICT", write_dictionary(tmp_path, "a little dragon could not sleep"))
+    doc = story_codec.story_to_document({"id": "s1", "content": STORY})
+    assert doc["content_dict"]
+
+    monkeypatch.setenv("STORY_CONTENT_DICT", write_dictionary(tmp_path, "a brave bunny hopped home"))
+    assert story_codec.story_from_document(doc)["content"] == STORY
+
+
+def test_unreadable_rows_are_skipped_in_lists(monkeypatch, tmp_path):
+    monkeypatch.setenv("STORY_CONTENT_DICT", write_dictionary(tmp_path, "a little dragon could not sleep"))
+    broken = story_codec.story_to_document({"id": "broken", "content": STORY})
+    monkeypatch.setenv("STORY_CONTENT_DICT", str(tmp_path / "elsewhere" / "missing.dict"))
+    fine = story_codec.story_to_document({"id": "fine", "content": STORY})
+
+    stories = story_codec.stories_from_documents([broken, fine])
+    assert [story["id"] for story in stories] == ["fine"]
+
+
+def test_list_previews_only_inflate_the_start(monkeypatch):
+    monkeypatch.delenv("STORY_CONTENT_DICT", raising=False)
+    doc = story_codec.story_to_document({"id": "s1", "content": STORY})
+    [preview] = story_codec.stories_from_documents([doc], max_chars=40)
+    assert preview["content"] == STORY[:40]
+    assert preview["content"].split("\n")[0] == "The Sleepy Dragon"
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from story_sync import SyncCursor, changes_query, decode_sync_token, encode_sync_token, server_stamped
+
+T0 = datetime(2024, 5, 1, 12, 0, 0)
+LOOKBACK = timedelta(seconds=10)
+
+
+def story(story_id, seconds):
+    return {"id": story_id, "updated_at": T0 + timedelta(seconds=seconds)}
+
+
+def matches(query, doc):
+    """Just enough of MongoDB's matcher for changes_query()."""
+    if doc["updated_at"] < query["updated_at"]["$gte"]:
+        return False
+    return not any(all(doc[k] == v for k, v in clause.items()) for clause in query.get("$nor", []))
+
+
+def sync(collection, cursor):
+    query = changes_query(cursor, LOOKBACK)
+    docs = sorted((doc for doc in collection if matches(query, doc)), key=lambda d: (d["updated_at"], d["id"]))
+    return docs, cursor.advance(docs, LOOKBACK)
+
+
+def test_token_roundtrip():
+    cursor = SyncCursor().advance([story("a", 0), story("b", 1)], LOOKBACK)
+    decoded = decode_sync_token(encode_sync_token(cursor))
+    assert decoded.high_water == cursor.high_water
+    assert decoded.seen == cursor.seen
+
+
+def test_empty_collection_still_gets_a_token():
+    decoded = decode_sync_token(encode_sync_token(SyncCursor().advance([], LOOKBACK)))
+    assert decoded.seen == set()
+
+
+@pytest.mark.parametrize("token", ["garbage", "", encode_sync_token(SyncCursor())[:-4]])
+def test_invalid_token_is_rejected(token):
+    with pytest.raises(HTTPException) as error:
+        decode_sync_token(token)
+    assert error.value.status_code == 400
+
+
+def test_query_rereads_lookback_and_skips_seen_versions():
+    cursor = SyncCursor().advance([story("a", 30)], LOOKBACK)
+    query = changes_query(cursor, LOOKBACK)
+    assert query["updated_at"] == {"$gte": T0 + timedelta(seconds=20)}
+    assert query["$nor"] == [{"id": "a", "updated_at": T0 + timedelta(seconds=30)}]
+
+
+def test_ties_on_updated_at_are_not_lost():
+    collection = [story("a", 5), story("b", 5)]
+    docs, cursor = sync(collection, SyncCursor())
+    assert [d["id"] for d in docs] == ["a", "b"]
+
+    collection.append(story("c", 5))
+    docs, cursor = sync(collection, cursor)
+    assert [d["id"] for d in docs] == ["c"]
+
+
+def test_late_commit_inside_lookback_is_picked_up():
+    collection = [story("a", 0), story("b", 8)]
+    _, cursor = sync(collection, SyncCursor())
+
+    # Stamped before b but committed after the client synced
+    collection.append(story("late", 3))
+    docs, cursor = sync(collection, cursor)
+    assert [d["id"] for d in docs] == ["late"]
+
+    docs, _ = sync(collection, cursor)
+    assert docs == []
+
+
+def test_updated_story_is_sent_again():
+    collection = [story("a", 0)]
+    _, cursor = sync(collection, SyncCursor())
+    collection[0] = story("a", 2)
+    docs, _ = sync(collection, cursor)
+    assert docs == [story("a", 2)]
+
+
+def test_seen_versions_are_pruned_outside_lookback():
+    cursor = SyncCursor().advance([story("a", 0), story("b", 1)], LOOKBACK)
+    cursor = cursor.advance([story("c", 60)], LOOKBACK)
+    assert {story_id for story_id, _ in cursor.seen} == {"c"}
+
+
+def test_server_stamped_uses_mongo_clock_and_literal_values():
+    stage = server_stamped({"audio_url": "$not-a-field-path", "updated_at": T0})[0]["$set"]
+    assert stage == {"audio_url": {"$literal": "$not-a-field-path"}, "updated_at": "$$NOW"}
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from write_buffer import WriteBehindBuffer
+
+
+class FakeCollection:
+    def __init__(self, fail=None):
+        self.batches = []
+        self.ordered = []
+        # Called with the operations; may raise to simulate a failed bulk_write
+        self.fail = fail
+
+    async def bulk_write(self, operations, ordered=True):
+        self.batches.append(list(operations))
+        self.ordered.append(ordered)
+        if self.fail:
+            self.fail(operations)
+
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+def run(scenario, max_batch=100, max_delay=0.01, db=None, on_flush=None):
+    db = FakeDB() if db is None else db
+    buffer = WriteBehindBuffer(max_batch=max_batch, max_delay=max_delay)
+
+    async def main():
+        buffer.start(db, on_flush=on_flush)
+        try:
+            return await scenario(buffer)
+        finally:
+            await buffer.stop()
+
+    return asyncio.run(main()), db, buffer
+
+
+def test_batches_are_unordered():
+    async def scenario(buffer):
+        await buffer.insert("stories", {"id": 1})
+
+    _, db, _ = run(scenario)
+    assert db["stories"].ordered == [False]
+
+
+def test_concurrent_writes_are_group_committed():
+    async def scenario(buffer):
+        await asyncio.gather(*(buffer.insert("stories", {"id": i}) for i in range(5)))
+
+    _, db, buffer = run(scenario)
+    assert [len(batch) for batch in db["stories"].batches] == [5]
+    assert buffer.stats()["operations"] == 5
+
+
+def test_batches_are_split_at_max_batch():
+    async def scenario(buffer):
+        await asyncio.gather(*(buffer.insert("stories", {"id": i}) for i in range(5)))
+
+    _, db, _ = run(scenario, max_batch=2)
+    assert [len(batch) for batch in db["stories"].batches] == [2, 2, 1]
+
+
+def test_stop_drains_queued_writes():
+    async def scenario(buffer):
+        for i in range(3):
+            await buffer.update("stories", {"id": i}, {"$set": {"audio_url": "x"}}, wait=False)
+
+    _, db, _ = run(scenario, max_delay=10)
+    assert sum(len(batch) for batch in db["stories"].batches) == 3
+
+
+def test_write_error_fails_only_that_write():
+    def fail(operations):
+        raise BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "duplicate key"}], "writeConcernErrors": []})
+
+    db = FakeDB(stories=FakeCollection(fail))
+
+    async def scenario(buffer):
+        return await asyncio.gather(*(buffer.insert("stories", {"id": i}) for i in range(3)),
+                                    return_exceptions=True)
+
+    results, _, buffer = run(scenario, db=db)
+    assert results[0] is None and results[2] is None
+    assert str(results[1]) == "duplicate key"
+    assert buffer.stats()["failed_operations"] == 1
+
+
+@pytest.mark.parametrize("details", [
+    {"writeErrors": [], "writeConcernErrors": [{"errmsg": "waiting for replication timed out"}]},
+    {"writeErrors": [], "writeConcernErrors": []},
+    {},
+])
+def test_write_concern_error_fails_every_write(details):
+    def fail(operations):
+        raise BulkWriteError(details)
+
+    db = FakeDB(stories=FakeCollection(fail))
+
+    async def scenario(buffer):
+        return await asyncio.gather(*(buffer.insert("stories", {"id": i}) for i in range(2)),
+                                    return_exceptions=True)
+
+    results, _, _ = run(scenario, db=db)
+    assert all("Write concern error" in str(result) for result in results)
+
+
+def test_flusher_survives_errors_and_failing_callback():
+    calls = []
+
+    def on_flush(collection):
+        calls.append(collection)
+        raise RuntimeError("listener broke")
+
+    def fail(operations):
+        if len(db["stories"].batches) == 1:
+            raise ConnectionError("mongo down")
+
+    db = FakeDB()
+    db["stories"] = FakeCollection(fail)
+
+    async def scenario(buffer):
+        with pytest.raises(ConnectionError):
+            await buffer.insert("stories", {"id": 1})
+        await buffer.insert("stories", {"id": 2})
+        await buffer.insert("stories", {"id": 3})
+
+    run(scenario, db=db, on_flush=on_flush)
+    assert calls == ["stories", "stories"]
+
+
+def test_dead_flusher_is_restarted():
+    async def scenario(buffer):
+        buffer._task.cancel()
+        await asyncio.sleep(0)
+        await buffer.insert("stories", {"id": 1})
+
+    _, db, _ = run(scenario)
+    assert len(db["stories"].batches) == 1
+
+
+def test_writes_fail_fast_when_not_started():
+    async def main():
+        await WriteBehindBuffer().insert("stories", {"id": 1})
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())